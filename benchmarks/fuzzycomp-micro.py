@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import random
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation'))
+import fuzzycomp
+# Usage: python benchmarks/fuzzycomp-micro.py [--save] [BASELINE]
+#
+# Times the fuzzycomp similarity and phonetic functions on generated inputs
+# of several lengths and alphabets and compares the times with BASELINE
+# (default benchmarks/fuzzycomp-baseline.json). Exits with status 1 if a
+# function got more than TOLERANCE slower. --save writes the current
+# times as the new baseline. Times are scaled by a calibration loop, so a
+# baseline from a faster or slower machine stays roughly comparable.
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fuzzycomp-baseline.json')
+TOLERANCE = 0.25
+PAIRS = 200
+SEED = 0
+
+ASCII = "abcdefghijklmnopqrstuvwxyz"
+LATIN = u"abcdefghijklmnopqrstuvwxyzäöüßéèêàçñøåæœ"
+
+# (name, alphabet, minimum and maximum length); "utf8" are the bytes of
+# "unicode", as disambiguation.py passes them to jaro_winkler
+INPUTS = [("short", ASCII, 3, 8),
+          ("medium", ASCII + "  ", 10, 20),
+          ("long", ASCII + "  ", 30, 60),
+          ("unicode", LATIN + u"  ", 10, 20),
+          ("utf8", LATIN + u"  ", 10, 20)]
+
+SIMILARITY = [("levenshtein_distance", fuzzycomp.levenshtein_distance),
+              ("jaro_winkler", fuzzycomp.jaro_winkler),
+              ("dice_coefficient", fuzzycomp.dice_coefficient),
+              ("tversky_index", lambda a, b: fuzzycomp.tversky_index(a, b, 0.5, 0.5))]
+
+PHONETIC = [("soundex", fuzzycomp.soundex),
+            ("nysiis", fuzzycomp.nysiis),
+            ("metaphone", fuzzycomp.metaphone),
+            ("cologne_phonetic", fuzzycomp.cologne_phonetic)]
+
+
+def _string(rnd, alphabet, low, high):
+    s = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(low, high))).strip()
+    return s or alphabet[0]
+
+
+def _mutated(rnd, s, alphabet):
+    '''s with about a fifth of the characters replaced, like an OCR variant'''
+    return "".join(c if rnd.random() > 0.2 else rnd.choice(alphabet) for c in s).strip() or s
+
+
+def inputs(name, alphabet, low, high, seed=SEED):
+    rnd = random.Random(seed)
+    pairs = []
+    for _ in range(PAIRS):
+        a = _string(rnd, alphabet, low, high)
+        b = _mutated(rnd, a, alphabet)
+        if name == "utf8":
+            a, b = a.encode("utf-8"), b.encode("utf-8")
+        elif name != "unicode":
+            a, b = str(a), str(b)
+        pairs.append((a, b))
+    return pairs
+
+
+def calibration():
+    '''seconds of a fixed pure Python loop, the unit of the stored times'''
+    def loop():
+        total = 0
+        for i in xrange(10000):
+            total += i % 7
+        return total
+    return min(timeit.repeat(loop, repeat=5, number=10))
+
+
+def _time(call, repeat):
+    try:
+        call()
+    except Exception:
+        return None
+    return min(timeit.repeat(call, repeat=repeat, number=1))
+
+
+def run(repeat=5):
+    '''seconds per call of every function and input, None where a function
+       does not accept the input'''
+    results = dict()
+    for name, alphabet, low, high in INPUTS:
+        pairs = inputs(name, alphabet, low, high)
+        for fname, f in SIMILARITY:
+            t = _time(lambda: [f(a, b) for a, b in pairs], repeat)
+            results[fname + "/" + name] = t and t / len(pairs)
+        for fname, f in PHONETIC:
+            t = _time(lambda: [f(a) for a, b in pairs], repeat)
+            results[fname + "/" + name] = t and t / len(pairs)
+    return results
+
+
+def compare(results, unit, baseline):
+    '''names of the benchmarks that got slower than the baseline allows'''
+    slower = []
+    print "%-30s %12s %12s %8s" % ("benchmark", "us/call", "baseline", "ratio")
+    for key in sorted(results):
+        current = results[key]
+        before = baseline["results"].get(key)
+        if current is None:
+            print "%-30s %12s" % (key, "n/a")
+            continue
+        if before is None:
+            print "%-30s %12.2f %12s" % (key, current * 1e6, "-")
+            continue
+        # baseline time on this machine
+        before = before * unit / baseline["calibration"]
+        ratio = current / before
+        flag = ""
+        if ratio > 1 + TOLERANCE:
+            slower.append(key)
+            flag = "  SLOWER"
+        print "%-30s %12.2f %12.2f %7.2fx%s" % (key, current * 1e6, before * 1e6, ratio, flag)
+    return slower
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    save = "--save" in args
+    args = [a for a in args if a != "--save"]
+    fname = args and args[0] or BASELINE
+
+    unit = calibration()
+    results = run()
+    if save:
+        out = open(fname, "w")
+        json.dump({"calibration": unit, "results": results}, out, indent=1, sort_keys=True)
+        out.close()
+        print "wrote %d results to %s" % (len(results), fname)
+    elif os.path.exists(fname):
+        ins = open(fname, "r")
+        baseline = json.load(ins)
+        ins.close()
+        slower = compare(results, unit, baseline)
+        if slower:
+            print "%d benchmarks more than %d%% slower than %s" % (len(slower), TOLERANCE * 100, fname)
+            sys.exit(1)
+    else:
+        compare(results, unit, {"calibration": unit, "results": {}})
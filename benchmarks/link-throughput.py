@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import bisect
+import random
+import resource
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import multiprocessing
+from collections import defaultdict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation'))
+import normalize
+import disambiguation
+# Usage: python benchmarks/link-throughput.py [STRINGS [MODE [ZIPF-EXPONENT [NOISE [RECORDING [LATENCY]]]]]]
+#
+# Links STRINGS (default 20000) entity strings drawn with Zipfian
+# repetition (default exponent 1.1) from the labels of a generated label
+# database and, with probability NOISE (default 0.3), from the common
+# English words of testdata, against a stand-in Solr that runs in a child
+# process. MODE is "single" (linkEntity per string, default) or "list"
+# (disambiguateList per page of PAGE_SIZE strings). Prints entities per
+# second, the latency of the phases of linking and the memory used.
+#
+# With RECORDING, a path template like disambiguation.SOLR_RECORD (e.g.
+# bench-%s.rec.gz), the Solr responses are recorded if the file does not
+# exist yet, and otherwise replayed from it instead of running the
+# stand-in, after LATENCY seconds (default 0) per request.
+
+WORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation',
+                     'testdata', '4000-most-common-english-words-csv.csv')
+ENTITIES = 5000
+PAGE_SIZE = 50
+SEED = 0
+
+
+def readWords():
+    ins = open(WORDS, "r")
+    words = [line.strip() for line in ins if line.strip() and not line.startswith("Source")]
+    ins.close()
+    return words
+
+
+def labelDatabase(words, size=ENTITIES, seed=SEED):
+    '''generated DBpedia documents with 1-3 word labels and redirect labels'''
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(size):
+        label = " ".join(rnd.choice(words).title() for _ in range(rnd.randint(1, 3)))
+        redirects = [" ".join(rnd.choice(words).title() for _ in range(rnd.randint(1, 2)))
+                     for _ in range(rnd.randint(0, 3))]
+        docs.append({
+            "id": "<http://dbpedia.org/resource/%s_%d>" % (label.replace(" ", "_"), i),
+            "label_en": label,
+            "label_en_normalized": normalize.normalizedLabel(label),
+            "redirectLabel": redirects,
+            "redirectLabel_normalized": [normalize.normalizedLabel(r) for r in redirects],
+            "schemaorgtype": [rnd.choice(["Person", "Place", "Organization"])],
+            "inlinks": int(rnd.paretovariate(1.0)),
+        })
+    return docs
+
+
+class StandInSolr(object):
+    '''answers candidate queries like the dbpedia core: documents sharing a
+       label or redirect label term, ranked by shared terms and inlinks'''
+
+    _term = re.compile(r'(?:label_en|redirectLabel):([^\s"()^]+)')
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.index = defaultdict(set)
+        for i, d in enumerate(docs):
+            for label in [d["label_en"]] + d["redirectLabel"]:
+                for term in label.lower().split():
+                    self.index[term].add(i)
+
+    def select(self, params):
+        terms = set(self._term.findall(params.get("q", [""])[0]))
+        hits = defaultdict(int)
+        for term in terms:
+            for i in self.index.get(term.replace("\\", ""), ()):
+                hits[i] += 1
+        rows = int(params.get("rows", ["10"])[0])
+        fl = params.get("fl", ["*"])[0].split(",")
+        scored = sorted(((n * (1.0 + math.log(1 + self.docs[i]["inlinks"])), i)
+                         for i, n in hits.iteritems()), reverse=True)[:rows]
+        docs = []
+        for score, i in scored:
+            doc = dict((k, v) for k, v in self.docs[i].iteritems() if k in fl)
+            doc["score"] = score
+            docs.append(doc)
+        return json.dumps({"response": {"numFound": len(hits), "start": 0,
+                                        "maxScore": scored and scored[0][0] or 0.0,
+                                        "docs": docs}})
+
+
+def _serve(docs, ports):
+    standIn = StandInSolr(docs)
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            data = standIn.select(urlparse.parse_qs(body))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def zipfWorkload(docs, words, count, exponent=1.1, noise=0.3, seed=SEED):
+    '''count entity strings, the r-th most frequent string occurs ~1/r^exponent'''
+    rnd = random.Random(seed)
+    vocabulary = []
+    for i in range(len(docs) + len(words)):
+        if rnd.random() < noise:
+            vocabulary.append(rnd.choice(words))
+        else:
+            d = rnd.choice(docs)
+            labels = [d["label_en"]] + d["redirectLabel"]
+            vocabulary.append(rnd.choice(labels))
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return [vocabulary[bisect.bisect(cumulative, rnd.random() * total)] for _ in range(count)]
+
+
+class PhaseTimer(object):
+    '''wraps module functions and records their exclusive time per call'''
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.stack = []
+
+    def wrap(self, owner, name, phase):
+        original = getattr(owner, name)
+
+        def timed(*args, **kw):
+            self.stack.append(0.0)
+            start = time.time()
+            try:
+                return original(*args, **kw)
+            finally:
+                elapsed = time.time() - start
+                children = self.stack.pop()
+                self.samples[phase].append(elapsed - children)
+                if self.stack:
+                    self.stack[-1] += elapsed
+        setattr(owner, name, timed)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def benchmark(count=20000, mode="single", exponent=1.1, noise=0.3, recording=None, latency=0.0):
+    words = readWords()
+    docs = labelDatabase(words)
+    workload = zipfWorkload(docs, words, count, exponent, noise)
+
+    server = None
+    if recording is not None and os.path.exists(recording % "en"):
+        disambiguation.SOLR_REPLAY = recording
+        disambiguation.REPLAY_LATENCY = latency
+    else:
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(target=_serve, args=(docs, ports))
+        server.daemon = True
+        server.start()
+        disambiguation.SOLR_URL = "http://127.0.0.1:%d/solr/dbpedia_%%s" % ports.get()
+        if recording is not None:
+            disambiguation.SOLR_RECORD = recording
+
+    timer = PhaseTimer()
+    timer.wrap(disambiguation, "_queries", "query build")
+    timer.wrap(disambiguation, "_solr", "http")
+    timer.wrap(disambiguation, "_parseCandidates", "json parse")
+    timer.wrap(disambiguation, "_bestMatch", "scoring")
+
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if mode == "list":
+        for i in range(0, len(workload), PAGE_SIZE):
+            disambiguation.disambiguateList(workload[i:i + PAGE_SIZE])
+    else:
+        for s in workload:
+            disambiguation.linkEntity(s)
+    elapsed = time.time() - start
+    rssAfter = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if server is not None:
+        server.terminate()
+    disambiguation.closeRecordings()
+
+    linked = sum(1 for m in disambiguation._cache("en").itervalues() if m[0] is not None)
+    print "%d strings (%d distinct), mode %s, zipf %.2f, noise %.2f, %s" % (
+        count, len(set(workload)), mode, exponent, noise,
+        server is None and "replaying " + recording % "en" or "stand-in Solr")
+    print "%.0f entities/s, %.3f ms per entity, %d linked, %d unlinkable cached" % (
+        count / elapsed, elapsed / count * 1000, linked, len(disambiguation._negativeCache("en")))
+    print "%-12s %8s %10s %10s %10s" % ("phase", "calls", "mean ms", "p50 ms", "p99 ms")
+    for phase in ["query build", "http", "json parse", "scoring"]:
+        samples = timer.samples[phase]
+        if samples:
+            print "%-12s %8d %10.3f %10.3f %10.3f" % (
+                phase, len(samples), sum(samples) / len(samples) * 1000,
+                _percentile(samples, 0.5) * 1000, _percentile(samples, 0.99) * 1000)
+    print "max RSS %.1f MB (%.1f MB during the run)" % (rssAfter / 1024.0, (rssAfter - rssBefore) / 1024.0)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    # only the given arguments, the others keep their defaults (a given 0,
+    # e.g. NOISE 0 for no noise, is kept)
+    types = [int, str, float, float, str, float]
+    benchmark(*[convert(arg) for convert, arg in zip(types, args)])
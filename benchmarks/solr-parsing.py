@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import random
+import timeit
+from StringIO import StringIO
+from xml.sax.saxutils import escape, quoteattr
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation'))
+import solr
+# Usage: python benchmarks/solr-parsing.py [ROWS ...]
+#
+# Compares the XML (wt=standard) and JSON (wt=json) response parsers of
+# solr.SearchHandler on generated DBpedia candidate pages of ROWS documents.
+
+WORDS = ["Amsterdam", "Einstein", "Paris", "Texas", "Albert", "Koninklijke",
+         "Bibliotheek", "Utrecht", u"München", u"Zürich", "Company",
+         "River", "Saint", "John", "Hague", u"François", "Rotterdam"]
+
+
+def _label(rnd, n):
+    return " ".join(rnd.choice(WORDS) for _ in range(n))
+
+
+def candidateDocs(rows, seed=0):
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(rows):
+        label = _label(rnd, rnd.randint(1, 3))
+        docs.append({
+            "id": "<http://dbpedia.org/resource/%s_%d>" % (label.replace(" ", "_"), i),
+            "label_en": label,
+            "redirectLabel": [_label(rnd, rnd.randint(1, 3)) for _ in range(rnd.randint(0, 8))],
+            "schemaorgtype": rnd.sample(["Person", "Place", "Organization", "Thing"], 2),
+            "abstract_en": _label(rnd, 40),
+            "inlinks": rnd.randint(0, 20000),
+            "score": rnd.random() * 10,
+        })
+    return docs
+
+
+def _xmlValue(tag, value, name=None):
+    attr = name is not None and " name=%s" % quoteattr(name) or ""
+    return u"<%s%s>%s</%s>" % (tag, attr, escape(unicode(value)), tag)
+
+
+def asXml(docs):
+    out = [u'<?xml version="1.0" encoding="UTF-8"?>\n<response>',
+           u'<lst name="responseHeader"><int name="status">0</int><int name="QTime">3</int></lst>',
+           u'<result name="response" numFound="%d" start="0" maxScore="%s">' % (
+               len(docs), max([d["score"] for d in docs] or [0.0]))]
+    for d in docs:
+        out.append(u"<doc>")
+        for name, value in d.items():
+            if isinstance(value, list):
+                out.append(u"<arr name=%s>%s</arr>" % (
+                    quoteattr(name), "".join(_xmlValue("str", v) for v in value)))
+            elif isinstance(value, int):
+                out.append(_xmlValue("int", value, name))
+            elif isinstance(value, float):
+                out.append(_xmlValue("float", repr(value), name))
+            else:
+                out.append(_xmlValue("str", value, name))
+        out.append(u"</doc>")
+    out.append(u"</result></response>")
+    return u"".join(out).encode("utf-8")
+
+
+def asJson(docs):
+    return json.dumps({
+        "responseHeader": {"status": 0, "QTime": 3},
+        "response": {"numFound": len(docs), "start": 0,
+                     "maxScore": max([d["score"] for d in docs] or [0.0]),
+                     "docs": docs}})
+
+
+def benchmark(rows, repeat=5):
+    docs = candidateDocs(rows)
+    xml = asXml(docs)
+    data = asJson(docs)
+
+    fromXml = solr.parse_query_response(StringIO(xml), {}, None)
+    fromJson = solr.parse_json_query_response(data, {}, None)
+    assert list(fromXml) == list(fromJson)
+    assert fromXml.numFound == fromJson.numFound
+
+    number = max(1, 2000 / rows)
+    tXml = min(timeit.repeat(lambda: solr.parse_query_response(StringIO(xml), {}, None),
+                             repeat=repeat, number=number)) / number
+    tJson = min(timeit.repeat(lambda: solr.parse_json_query_response(data, {}, None),
+                              repeat=repeat, number=number)) / number
+    print "%6d %10d %10d %12.3f %12.3f %8.1fx" % (
+        rows, len(xml), len(data), tXml * 1000, tJson * 1000, tXml / tJson)
+
+if __name__ == '__main__':
+    print "%6s %10s %10s %12s %12s %9s" % (
+        "rows", "xml bytes", "json bytes", "xml ms", "json ms", "speedup")
+    for rows in [int(r) for r in sys.argv[1:]] or [5, 50, 500, 5000]:
+        benchmark(rows)
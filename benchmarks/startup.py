@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import tempfile
+import subprocess
+DISAMBIGUATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation')
+sys.path.insert(0, DISAMBIGUATION)
+# Usage: python benchmarks/startup.py [LABELS [WORKERS]]
+#
+# Measures how long a process needs until it links its first entity:
+#   cold     a new interpreter importing disambiguation and initializing it
+#   lazy     a worker forked after the import only, so its first linkEntity
+#            loads the character mapping and the exact label map itself
+#   forked   a worker forked after disambiguation.initialize(), which shares
+#            the loaded data and serves immediately
+# The exact label map of LABELS (default 200000) generated labels stands
+# in for a real one; the entities are linked by it, so no Solr is needed.
+# WORKERS (default 8) processes are started per mode.
+
+LABELS = 200000
+WORKERS = 8
+
+COLD = """
+import sys, time
+start = time.time()
+sys.path.insert(0, %r)
+import disambiguation
+disambiguation.EXACT_LABELS = %r
+imported = time.time()
+disambiguation.initialize(["en"])
+initialized = time.time()
+disambiguation.linkEntity("Label 1", "en")
+print imported - start, initialized - start, time.time() - start
+"""
+
+
+def writeLabels(directory, n):
+    '''exact label map of n labels "Label i", returns the file name template'''
+    template = os.path.join(directory, "exact-labels_%s.txt")
+    out = open(template % "en", "w")
+    for i in xrange(n):
+        out.write("label %d\t<http://dbpedia.org/resource/Label_%d>\t%d\tLabel %d\n" % (i, i, n - i, i))
+    out.close()
+    return template
+
+
+def cold(template, workers):
+    '''(import, initialize, first link) seconds of new interpreters'''
+    times = []
+    for _ in range(workers):
+        out = subprocess.check_output([sys.executable, "-c", COLD % (DISAMBIGUATION, template)])
+        times.append(tuple(float(t) for t in out.split()))
+    return times
+
+
+def forked(workers):
+    '''seconds from fork() to the first link of each forked worker'''
+    import disambiguation
+    times = []
+    for i in range(workers):
+        r, w = os.pipe()
+        start = time.time()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            disambiguation.linkEntity("Label %d" % (i + 1), "en")
+            os.write(w, repr(time.time() - start))
+            os._exit(0)
+        os.close(w)
+        result = os.read(r, 64)
+        os.close(r)
+        os.waitpid(pid, 0)
+        times.append(float(result))
+    return times
+
+
+def _ms(times):
+    times = sorted(times)
+    return "median %8.2f ms  max %8.2f ms" % (times[len(times) // 2] * 1000, times[-1] * 1000)
+
+
+if __name__ == '__main__':
+    labels = len(sys.argv) > 1 and int(sys.argv[1]) or LABELS
+    workers = len(sys.argv) > 2 and int(sys.argv[2]) or WORKERS
+
+    directory = tempfile.mkdtemp()
+    template = writeLabels(directory, labels)
+    try:
+        times = cold(template, workers)
+        print "cold     import     %s" % _ms([t[0] for t in times])
+        print "cold     initialize %s" % _ms([t[1] - t[0] for t in times])
+        print "cold     first link %s" % _ms([t[2] for t in times])
+
+        import disambiguation
+        disambiguation.EXACT_LABELS = template
+        print "lazy     first link %s" % _ms(forked(workers))
+
+        start = time.time()
+        disambiguation.initialize(["en"])
+        print "initialize in parent %.2f ms" % ((time.time() - start) * 1000)
+        print "forked   first link %s" % _ms(forked(workers))
+    finally:
+        os.remove(template % "en")
+        os.rmdir(directory)
@@ -0,0 +1,14 @@
+# Layout of final.csv, written by make-csv.py and read by index-delta.py,
+# make-exact-labels.py and make-page-links.py. The languages are given in
+# the same order as for prepare-solr-input.sh, the first one is the
+# language of the entity list.
+
+# schema.org types of the entities the Solr candidate query accepts
+TYPES = set(["Person", "Place", "Organization"])
+
+
+def fieldNames(languages):
+    '''column order of final.csv, also the Solr field of each column'''
+    return (["id"] + ["label_" + lang for lang in languages] + ["schemaorgtype"] +
+            ["abstract_" + lang for lang in languages] + ["redirectLabel", "inlinks"] +
+            ["label_" + lang + "_normalized" for lang in languages] + ["redirectLabel_normalized"])
@@ -0,0 +1,97 @@
+import os
+import sys
+import csv
+import hashlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation'))
+import solr
+from finalcsv import fieldNames
+# Usage: python index-delta.py FINAL-CSV OLD-FINGERPRINTS NEW-FINGERPRINTS [SOLR-URL [LANGUAGE ...]]
+#
+# Compares final.csv against the fingerprints written by the previous build
+# and sends only the changed entities to Solr. OLD-FINGERPRINTS may be
+# missing, in which case every entity is added. The languages must be given
+# in the same order as for prepare-solr-input.sh. Rows with a wrong number
+# of columns are reported and skipped; their entities keep the fingerprint
+# and the document of the previous build.
+
+SOLR_URL = "http://localhost:8983/solr/dbpedia"
+BATCH_SIZE = 1000
+
+
+def fingerprint(row):
+    '''digest over the indexed fields of a final.csv row (everything but the id)'''
+    return hashlib.md5("\x00".join(row[1:])).hexdigest()
+
+
+def toDoc(fields, row):
+    doc = dict()
+    for field, value in zip(fields, row):
+        if field in ("schemaorgtype", "redirectLabel", "redirectLabel_normalized"):
+            value = [v.strip() for v in value.split("|") if v.strip()] or None
+        elif field == "inlinks":
+            value = int(value or 0)
+        elif not value:
+            value = None
+        doc[field] = value
+    return doc
+
+
+def readFingerprints(fname):
+    fingerprints = dict()
+    if not os.path.exists(fname):
+        return fingerprints
+    ins = open(fname, "r")
+    for line in ins:
+        splitted = line.rstrip("\n").rsplit(" ", 1)
+        fingerprints[splitted[0]] = splitted[1]
+    ins.close()
+    return fingerprints
+
+
+def indexDelta(csvName, oldName, newName, url=SOLR_URL, languages=("en",)):
+    fields = fieldNames(languages)
+    old = readFingerprints(oldName)
+    conn = solr.SolrConnection(url, update_format="json")
+    out = open(newName, "w")
+    batch = []
+    added = updated = skipped = 0
+    ins = open(csvName, "rb")
+    reader = csv.reader(ins)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(fields):
+            sys.stderr.write("%s:%d: %d columns instead of %d, skipped\n" %
+                             (csvName, reader.line_num, len(row), len(fields)))
+            skipped += 1
+            # neither update nor delete it
+            previous = old.pop(row[0], None)
+            if previous is not None:
+                out.write(row[0] + " " + previous + "\n")
+            continue
+        fp = fingerprint(row)
+        out.write(row[0] + " " + fp + "\n")
+        previous = old.pop(row[0], None)
+        if previous == fp:
+            continue
+        if previous is None:
+            added += 1
+        else:
+            updated += 1
+        batch.append(toDoc(fields, row))
+        if len(batch) >= BATCH_SIZE:
+            conn.add_many(batch)
+            batch = []
+    ins.close()
+    out.close()
+    if batch:
+        conn.add_many(batch)
+
+    deleted = old.keys()
+    for i in range(0, len(deleted), BATCH_SIZE):
+        conn.delete_many(deleted[i:i + BATCH_SIZE])
+    conn.commit()
+    print "added %d, updated %d, deleted %d, skipped %d" % (added, updated, len(deleted), skipped)
+
+if __name__ == '__main__':
+    indexDelta(*sys.argv[1:5], languages=sys.argv[5:] or ["en"])
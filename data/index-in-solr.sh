@@ -1 +1,5 @@
-curl "http://localhost:8983/solr/dbpedia/update/csv?header=false&fieldnames=id,label_en,schemaorgtype,abstract_en,redirectLabel,inlinks&encapsulator=\"&f.redirectLabel.split=true&f.redirectLabel.separator=|&f.schemaorgtype.split=true&f.schemaorgtype.separator=|&stream.file=../../data/final.csv&stream.contentType=text/csv;charset=utf-8"
+#!/bin/bash
+#Usage: ./index-in-solr.sh [LANGUAGE ...]   (default: en, same order as for prepare-solr-input.sh)
+LANGUAGES=${@:-en}
+FIELDNAMES=$(python -c "import sys, finalcsv; print ','.join(finalcsv.fieldNames(sys.argv[1:]))" $LANGUAGES)
+curl "http://localhost:8983/solr/dbpedia/update/csv?header=false&fieldnames=$FIELDNAMES&encapsulator=\"&f.redirectLabel.split=true&f.redirectLabel.separator=|&f.redirectLabel_normalized.split=true&f.redirectLabel_normalized.separator=|&f.schemaorgtype.split=true&f.schemaorgtype.separator=|&stream.file=../../data/final.csv&stream.contentType=text/csv;charset=utf-8"
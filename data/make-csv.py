@@ -1,4 +1,9 @@
+import os
+import sys
 from collections import defaultdict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation'))
+from normalize import normalizedLabel
+from finalcsv import fieldNames
 xstr = lambda s: s or ""
 xzero = lambda s: s or "0"
 
@@ -15,13 +20,46 @@ for line in ins:
         redirectlabels[splitted[0]]=splitted[1]
 ins.close()
 
+# Usage: python make-csv.py [LANGUAGE ...]   (default: en)
+# Columns: see finalcsv.py
+languages = sys.argv[1:] or ["en"]
+fields = fieldNames(languages)
+
+def readValues(fname):
+	values=dict()
+	ins = open( fname, "r" )
+	for line in ins:
+		splitted=line.split (' ',1)
+		values[splitted[0]]=splitted[1].rstrip().lstrip()
+	ins.close()
+	return values
 
 labels=dict()
-ins = open( "labels.txt", "r" )
-for line in ins:
-	splitted=line.split (' ',1)
-	labels[splitted[0]]=splitted[1].rstrip().lstrip()
-ins.close()
+abstracts=dict()
+for lang in languages:
+	labels[lang]=readValues("labels_"+lang+".txt")
+	if lang != languages[0]:
+		abstracts[lang]=readValues("abstracts_"+lang+".txt")
+
+def quotedAbstract(value):
+	return "\""+xstr(value).rstrip().lstrip().replace("\"","")+"\""
+
+# labels are "..." with \" inside, redirect labels "...|..." with ""
+def unquoted(value):
+	value=xstr(value).strip()
+	if len(value)>1 and value[0]=="\"" and value[-1]=="\"":
+		value=value[1:-1]
+	return value.replace("\\\"","\"").replace("\"\"","\"")
+
+def quoted(value):
+	return "\""+value.replace("\"","\"\"")+"\""
+
+def normalizedColumn(value):
+	return quoted(normalizedLabel(unquoted(value)).encode("utf-8"))
+
+def normalizedRedirects(value):
+	labels=[normalizedLabel(l).encode("utf-8") for l in unquoted(value).split("|")]
+	return quoted("|".join([l for l in labels if l]))
 
 schemaorgtypes=dict()
 ins = open( "schemaorgtypes-summed.txt", "r" )
@@ -30,10 +68,23 @@ for line in ins:
 	schemaorgtypes[splitted[0]]=splitted[1].rstrip().lstrip()
 ins.close()
 
-ins = open( "abstracts.txt", "r" )
+ins = open( "abstracts_"+languages[0]+".txt", "r" )
 for line in ins:
 	splitted=line.split (' ',1)
-	print "\""+splitted[0].replace("\"","\\\"")+"\","+xstr(labels.get(splitted[0]))+","+xstr(schemaorgtypes.get(splitted[0]))+",\""+xstr(splitted[1]).rstrip().lstrip().replace("\"","")+"\","+xstr(redirectlabels.get(splitted[0]))+","+xzero(pagecount.get(splitted[0]))    
+	entity=splitted[0]
+	columns=dict()
+	columns["id"]="\""+entity.replace("\"","\\\"")+"\""
+	for lang in languages:
+		columns["label_"+lang]=xstr(labels[lang].get(entity))
+		columns["label_"+lang+"_normalized"]=normalizedColumn(labels[lang].get(entity))
+	columns["schemaorgtype"]=xstr(schemaorgtypes.get(entity))
+	columns["abstract_"+languages[0]]=quotedAbstract(splitted[1])
+	for lang in languages[1:]:
+		columns["abstract_"+lang]=quotedAbstract(abstracts[lang].get(entity))
+	columns["redirectLabel"]=xstr(redirectlabels.get(entity))
+	columns["inlinks"]=xzero(pagecount.get(entity))
+	columns["redirectLabel_normalized"]=normalizedRedirects(redirectlabels.get(entity))
+	print ",".join([columns[f] for f in fields])
 ins.close()
 
 
@@ -0,0 +1,62 @@
+import sys
+import csv
+from finalcsv import TYPES, fieldNames
+# Usage: python make-exact-labels.py FINAL-CSV [LANGUAGE ...]
+#
+# Writes the exact label map exact-labels_<lang>.txt of every language for
+# disambiguation.EXACT_LABELS: one line per normalized label or redirect
+# label with the entity that has the most inlinks,
+#   normalized label TAB id TAB inlinks TAB main label TAB types
+# Only entities of the types the Solr candidate query accepts are used;
+# types are those of them, separated by "|", for the type hints. The
+# languages must be given in the same order as for prepare-solr-input.sh;
+# rows with another number of columns are skipped and counted on stderr.
+
+
+def exactLabels(csvName, languages, lang):
+    fields = fieldNames(languages)
+    best = dict()
+    skipped = 0
+    ins = open(csvName, "rb")
+    reader = csv.reader(ins)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(fields):
+            if not skipped:
+                sys.stderr.write("%s:%d: %d columns instead of %d, skipped\n" %
+                                 (csvName, reader.line_num, len(row), len(fields)))
+            skipped += 1
+            continue
+        doc = dict(zip(fields, row))
+        types = TYPES.intersection(t.strip() for t in doc["schemaorgtype"].split("|"))
+        if not types:
+            continue
+        label = doc["label_" + lang].strip().replace("\t", " ")
+        inlinks = int(doc["inlinks"] or 0)
+        normalized = [doc["label_" + lang + "_normalized"].strip()]
+        normalized += doc["redirectLabel_normalized"].split("|")
+        for n in normalized:
+            n = n.strip()
+            if not n or "\t" in n:
+                continue
+            previous = best.get(n)
+            if previous is None or inlinks > previous[1]:
+                best[n] = (doc["id"], inlinks, label, "|".join(sorted(types)))
+    ins.close()
+    if skipped:
+        sys.stderr.write("%s: skipped %d rows, are the languages those of the build?\n" %
+                         (csvName, skipped))
+    return best
+
+
+def writeExactLabels(best, fname):
+    out = open(fname, "w")
+    for n, (entity, inlinks, label, types) in sorted(best.iteritems()):
+        out.write("%s\t%s\t%d\t%s\t%s\n" % (n, entity, inlinks, label, types))
+    out.close()
+
+if __name__ == '__main__':
+    languages = sys.argv[2:] or ["en"]
+    for lang in languages:
+        writeExactLabels(exactLabels(sys.argv[1], languages, lang), "exact-labels_" + lang + ".txt")
@@ -0,0 +1,46 @@
+import os
+import sys
+import csv
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disambiguation'))
+import pagelinks
+from finalcsv import TYPES, fieldNames
+# Usage: bzcat rawdata/page_links_en.nt.bz2 | python make-page-links.py FINAL-CSV [LANGUAGE ...]
+#
+# Writes the page links between the entities of final.csv as
+# page-links.ids and page-links.links for disambiguation.PAGE_LINKS, see
+# pagelinks.py. Only entities of the types the Solr candidate query
+# accepts are used. The languages must be given in the same order as for
+# prepare-solr-input.sh.
+
+
+def entities(csvName, languages):
+    '''sorted ids of the entities of the candidate types'''
+    fields = fieldNames(languages)
+    typeColumn = fields.index("schemaorgtype")
+    ids = set()
+    ins = open(csvName, "rb")
+    for row in csv.reader(ins):
+        if len(row) != len(fields):
+            continue
+        if TYPES.intersection(t.strip() for t in row[typeColumn].split("|")):
+            ids.add(row[0])
+    ins.close()
+    return sorted(ids)
+
+
+def links(ins, index):
+    '''(index, index) pairs of the N-Triples page links between entities'''
+    for line in ins:
+        splitted = line.split(" ")
+        if len(splitted) < 3:
+            continue
+        source = index.get(splitted[0])
+        target = index.get(splitted[2])
+        if source is not None and target is not None:
+            yield source, target
+
+if __name__ == '__main__':
+    languages = sys.argv[2:] or ["en"]
+    ids = entities(sys.argv[1], languages)
+    index = dict((id, i) for i, id in enumerate(ids))
+    pagelinks.build(ids, links(sys.stdin, index)).save("page-links")
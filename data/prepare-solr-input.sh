@@ -1,25 +1,54 @@
 #!/bin/bash
 #Creates a Solr compatible CSV file
+#Usage: ./prepare-solr-input.sh [LANGUAGE ...]   (default: en)
+#The first language drives the entity list; English redirects, types and
+#inlink counts are extracted once and shared by all languages.
 
-echo "Extract entities..."
-bzcat rawdata/short_abstracts_en.nt.bz2  | awk '/^\s*[^#]/ { print $1 }' | sort > entities-sorted.txt
+LANGUAGES=${@:-en}
+
+# DBpedia publishes non-English labels and abstracts with English URIs as
+# <dataset>_en_uris_<lang>.nt.bz2, so all languages end up in the same document.
+rawfile() {
+	if [ "$2" == "en" ]; then
+		echo "rawdata/$1_en.nt.bz2"
+	else
+		echo "rawdata/$1_en_uris_$2.nt.bz2"
+	fi
+}
+
+extract_language() {
+	echo "Extract labels ($1)..."
+	bzcat $(rawfile labels $1) | awk '/^\s*[^#]/ { ORS=""; print $1 " ";for (i=3;i<=NF-1;i++) print $i " "; print "\n" }' | sort | rev | cut -c5- | rev | native2ascii -encoding UTF-8 -reverse > labels_$1.txt
 
-echo "Extract labels..."
-bzcat rawdata/labels_en.nt.bz2 | awk '/^\s*[^#]/ { ORS=""; print $1 " ";for (i=3;i<=NF-1;i++) print $i " "; print "\n" }' | sort | rev | cut -c5- | rev | native2ascii -encoding UTF-8 -reverse > labels.txt
+	echo "Extract short abstracts ($1)..."
+	bzcat $(rawfile short_abstracts $1) | awk '/^\s*[^#]/ { ORS=""; print $1 " ";for (i=3;i<=NF-1;i++) print $i " "; print "\n" }' | rev | cut -c5- | rev | sed "s/\\\\\"/\"\"/g" | native2ascii -encoding UTF-8 -reverse > abstracts_$1.txt
+}
 
-echo "Extract short abstracts..."
-bzcat rawdata/short_abstracts_en.nt.bz2 | awk '/^\s*[^#]/ { ORS=""; print $1 " ";for (i=3;i<=NF-1;i++) print $i " "; print "\n" }' | rev | cut -c5- | rev | sed "s/\\\\\"/\"\"/g" | native2ascii -encoding UTF-8 -reverse > abstracts.txt
+extract_types() {
+	echo "Extract schema.org types..."
+	bzcat rawdata/instance_types_en.nt.bz2 | grep "http://schema.org" | cut -d " " -f 1,3 | sed "s/http:\/\/schema\.org\///g"  >schemaorgtypes.txt
+	python summarize.py schemaorgtypes.txt > schemaorgtypes-summed.txt
+}
 
-echo "Extract schema.org types..."
-bzcat rawdata/instance_types_en.nt.bz2 | grep "http://schema.org" | cut -d " " -f 1,3 | sed "s/http:\/\/schema\.org\///g"  >schemaorgtypes.txt 
-python summarize.py schemaorgtypes.txt > schemaorgtypes-summed.txt 
+extract_page_links() {
+	echo "Extract page link count..."
+	bzcat rawdata/page_links_en.nt.bz2| awk '/^\s*[^#]/ { ORS=""; for (i=3;i<=NF-1;i++) print $i " "; print "\n" }' | sort | uniq -c > page_links_count.txt
+}
+
+echo "Extract entities..."
+bzcat rawdata/short_abstracts_en.nt.bz2  | awk '/^\s*[^#]/ { print $1 }' | sort > entities-sorted.txt
 
-echo "Extract page link count..."
-bzcat rawdata/page_links_en.nt.bz2| awk '/^\s*[^#]/ { ORS=""; for (i=3;i<=NF-1;i++) print $i " "; print "\n" }' | sort | uniq -c > page_links_count.txt
+# English labels are always needed for the redirect labels
+for lang in $(echo $LANGUAGES en | tr " " "\n" | awk '!seen[$0]++'); do
+	extract_language $lang &
+done
+extract_types &
+extract_page_links &
+wait
 
 echo "Extract redirect labels..."
-bzcat rawdata/redirects_en.nt.bz2 | cut -d " " -f 1,3 |  sort | join - labels.txt | cut -d " " -f 2,3- >redirect-labels.txt
-python summarize.py redirect-labels.txt > redirect-labels-summed.txt 
+bzcat rawdata/redirects_en.nt.bz2 | cut -d " " -f 1,3 |  sort | join - labels_en.txt | cut -d " " -f 2,3- >redirect-labels.txt
+python summarize.py redirect-labels.txt > redirect-labels-summed.txt
 
 echo "Make final csv..."
-python make-csv.py | sed "s/|\"/| \"/g" | sed "s/,\"\"\"/,\" \"\"/g" > final.csv
+python make-csv.py $LANGUAGES | sed "s/|\"/| \"/g" | sed "s/,\"\"\"/,\" \"\"/g" > final.csv
@@ -0,0 +1,69 @@
+import os
+import math
+import time
+import struct
+import hashlib
+import binascii
+
+
+class BloomFilter(object):
+    '''Set of strings without false negatives and with about errorRate false
+       positives once capacity strings were added. Concurrent adds may lose
+       a bit, which only makes the filter forget a string. created is the
+       time the oldest string may have been added.'''
+
+    def __init__(self, capacity=1000000, errorRate=0.001):
+        self.bits = max(8, int(-capacity * math.log(errorRate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.bits) / capacity * math.log(2))))
+        self.array = bytearray((self.bits + 7) / 8)
+        self.created = time.time()
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        # double hashing: the i-th position is h1 + i * h2
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.array[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        for p in self._positions(key):
+            if not self.array[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def update(self, other):
+        '''add the strings of a filter of the same size'''
+        if (other.bits, other.hashes) != (self.bits, self.hashes):
+            raise ValueError("Bloom filters of different sizes")
+        # or'ed as long integers, much faster than byte by byte
+        merged = (int(binascii.hexlify(self.array), 16) |
+                  int(binascii.hexlify(other.array), 16))
+        self.array[:] = binascii.unhexlify("%0*x" % (2 * len(self.array), merged))
+        self.created = min(self.created, other.created)
+
+    def save(self, fname):
+        '''write the filter to a new file renamed to fname, so readers never
+           see half of it'''
+        tmp = "%s.%d" % (fname, os.getpid())
+        out = open(tmp, "wb")
+        out.write("%d %d %.3f\n" % (self.bits, self.hashes, self.created))
+        out.write(self.array)
+        out.close()
+        os.rename(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        ins = open(fname, "rb")
+        header = ins.readline().split()
+        f = cls.__new__(cls)
+        f.bits = int(header[0])
+        f.hashes = int(header[1])
+        # files without a creation time are of unknown age
+        f.created = len(header) > 2 and float(header[2]) or 0.0
+        f.array = bytearray(ins.read())
+        ins.close()
+        return f
@@ -5,29 +5,444 @@ import re
 import fuzzycomp
 import locale
 import math
+import contextlib
+import threading
+import Queue
+import socket
+import httplib
+import time
+import urllib
+import atexit
+import os
+import fcntl
+import normalize
+import bloom
+import metrics
+import pagelinks
 
 LANG = "en"
+LANGUAGES = ("en", "de", "nl", "es", "fr")
 
-s = solr.SolrConnection('http://localhost:8984/solr/dbpedia_' + LANG)
+# URL template of the core of a language; a list of templates spreads the
+# queries over replicas with a solr.BalancedSolrConnection.
+SOLR_URL = 'http://localhost:8984/solr/dbpedia_%s'
+# With replicas: resend a query to a second replica once it is slower than
+# this percentile of the recent query latencies (None disables hedging).
+HEDGE_PERCENTILE = None
+
+# Path templates of solr.SolrRecorder files per language: SOLR_RECORD
+# records the queries and responses, SOLR_REPLAY answers the queries from
+# such a recording instead of Solr, waiting REPLAY_LATENCY seconds per
+# request (None disables either). Replayed languages without a recording
+# reject every query as not recorded.
+SOLR_RECORD = None
+SOLR_REPLAY = None
+REPLAY_LATENCY = 0.0
+
+CACHE_SIZE = 10000
+
+# Entity strings that could not be linked (OCR noise, common words) are
+# remembered apart from the links, for NEGATIVE_CACHE_TTL seconds.
+NEGATIVE_CACHE_SIZE = 100000
+NEGATIVE_CACHE_TTL = 3600.0
+# Path template of a Bloom filter per language, e.g. 'negative_%s.bloom',
+# that keeps the strings that could not be linked between runs (None
+# disables it). A string found in it is not looked up again for
+# NEGATIVE_CACHE_TTL seconds, as if it were in the negative cache. A filter
+# cannot forget single strings, so it is started anew when it gets older
+# than NEGATIVE_FILTER_MAX_AGE seconds. Processes saving the same file add
+# their strings to it. Remove the files when the index changes.
+NEGATIVE_FILTER = None
+NEGATIVE_FILTER_CAPACITY = 1000000
+NEGATIVE_FILTER_ERROR_RATE = 0.001
+NEGATIVE_FILTER_MAX_AGE = 7 * 24 * 3600.0
+
+# Path template of the exact label maps written by data/make-exact-labels.py,
+# e.g. 'data/exact-labels_%s.txt'. Entity strings whose normalized form is a
+# key of the map of their language are linked to its entity with EXACT_SCORE
+# without querying Solr (None disables the lookup; languages without a map
+# are looked up in Solr only).
+EXACT_LABELS = None
+EXACT_SCORE = 1.0
+
+# Failure handling: per-request timeout (seconds), retries with
+# exponential backoff, and a circuit breaker per Solr core that stops
+# querying for BREAKER_RESET seconds after BREAKER_THRESHOLD failures.
+# A lookup against an unresponsive core gives up after about
+# (RETRIES + 1) * SOLR_TIMEOUT seconds (per replica) plus the backoff.
+SOLR_TIMEOUT = 5.0
+RETRIES = 2
+RETRY_BACKOFF = 0.1
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 30.0
+
+# Called as fallback(namedEntityString, lang) while Solr is unavailable;
+# may answer from an offline index with a (link, score, label) tuple.
+fallback = None
+
+# Only the fields the scorer reads; the abstracts are never transferred.
+# The labels are scored in the normalized form make-csv.py indexes; the
+# labels of an index built without those fields are normalized here.
+CANDIDATE_FIELDS = "id,label_%(lang)s,label_%(lang)s_normalized,redirectLabel,redirectLabel_normalized,score"
+CANDIDATE_ROWS = 5
+
+# Type hints, e.g. the TYPE of an ALTO NamedEntityTag, and the schema.org
+# type they restrict the candidates to (lowercase; other hints are ignored).
+TYPE_HINTS = {"person": "Person", "per": "Person",
+              "location": "Place", "loc": "Place", "place": "Place",
+              "organisation": "Organization", "organization": "Organization", "org": "Organization"}
+
+# Collective linking of the strings of a page in disambiguateList: with the
+# page links of data/make-page-links.py (path prefix), the candidates of a
+# string are reranked by how strongly they are linked with the candidates of
+# the other strings and the links of those already resolved. The coherence
+# is weighed by COHERENCE_WEIGHT against the candidate's own score; up to
+# COHERENCE_CANDIDATES candidates per string are considered for at most
+# COHERENCE_BUDGET seconds per page, the remaining strings keep their best
+# candidate. Needs the client ranking. Cached strings are reranked from the
+# candidates cached with their link, so a page links the same every time.
+PAGE_LINKS = None
+COHERENCE_WEIGHT = 0.5
+COHERENCE_CANDIDATES = 5
+COHERENCE_BUDGET = 0.05
+
+# "client" ranks the candidates here, "server" lets the /rank handler of
+# solrconfig.xml rerank them and fetches only the best one, "compare" does
+# both, returns the client ranking and counts in rankingComparison how
+# often the best candidates agree. The score of a link depends on the
+# ranking: the client weighs the label similarity by the candidate's share
+# of the Solr relevance, the server ranking returns the plain Jaro-Winkler
+# similarity of the main label, so the scores of the two do not compare.
+RANKING = "client"
+rankingComparison = {"same": 0, "different": 0}
+
+# Record the time of the phases of linkEntity (cache, exact, query, solr,
+# parse, scoring), the candidate and label counts and the cache outcomes in
+# the histograms and counters of metrics.py; see metrics.dump().
+TIMING = False
+_clock = getattr(time, "monotonic", time.time)
 
 CUTOFF_RELEVANCY = 0.0
 CUTOFF_SIMILARITY = 0.6
 CUTOFF_TOTAL_SCORE = 0.02
 
 
+_special = re.compile(r'(&&|\|\||[-+!(){}\[\]^"~*?:])')
+
+
 def _escapeQueryString(toEscape):
-    replaceCharacter = ["+", "-", "&&", "||", "!", "(", ")", "{",
-                        "}", "[", "]", "^", "\"", "~", "*", "?", ":"]
+    cleaned = toEscape.strip()
+    if _special.search(cleaned) is None:
+        return cleaned
+    return _special.sub(r'\\\1', cleaned)
+
+
+class SolrUnavailable(Exception):
+    '''Solr could not be queried and no degraded answer was available'''
+    pass
+
+
+class CircuitBreaker(object):
+    '''Counts consecutive failures; once open, lets a single probe request
+       through every resetTimeout seconds until one succeeds'''
+
+    def __init__(self, threshold=None, resetTimeout=None):
+        self.threshold = threshold or BREAKER_THRESHOLD
+        self.resetTimeout = resetTimeout or BREAKER_RESET
+        self.failures = 0
+        self.openedAt = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if time.time() - self.openedAt >= self.resetTimeout:
+                self.openedAt = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.openedAt = time.time()
+
+
+_pools = dict()
+_caches = dict()
+_candidateCaches = dict()
+_negativeCaches = dict()
+_negativeFilters = dict()
+_breakers = dict()
+_balancers = dict()
+_exactMaps = dict()
+_recorders = dict()
+_recordings = dict()
+_templates = dict()
+_links = None
+_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _connection(lang):
+    '''borrow a Solr connection for the core of a language from its pool'''
+    pool = _pools.get(lang)
+    if pool is None:
+        with _lock:
+            pool = _pools.setdefault(lang, Queue.Queue())
+    try:
+        conn = pool.get_nowait()
+    except Queue.Empty:
+        conn = _newConnection(lang)
+    try:
+        yield conn
+    except:
+        # the connection may be left mid-response, do not reuse it
+        conn.close()
+        raise
+    pool.put(conn)
+
+
+def _newConnection(lang):
+    # _solr does the retries, the client would multiply them
+    params = dict(timeout=SOLR_TIMEOUT, max_retries=0)
+    if SOLR_RECORD is not None:
+        with _lock:
+            if lang not in _recorders:
+                _recorders[lang] = solr.SolrRecorder(SOLR_RECORD % lang)
+            params["recorder"] = _recorders[lang]
+    if SOLR_REPLAY is not None:
+        url = isinstance(SOLR_URL, basestring) and SOLR_URL or SOLR_URL[0]
+        return solr.ReplaySolrConnection(url % lang, _recording(lang),
+                                         latency=REPLAY_LATENCY, **params)
+    if isinstance(SOLR_URL, basestring):
+        return solr.SolrConnection(SOLR_URL % lang, **params)
+    urls = [url % lang for url in SOLR_URL]
+    with _lock:
+        balancer = _balancers.get(lang)
+        if balancer is None:
+            balancer = _balancers[lang] = solr.SolrBalancer(urls, observer=_countHedge)
+    return solr.BalancedSolrConnection(urls, balancer=balancer,
+                                       hedge_percentile=HEDGE_PERCENTILE,
+                                       **params)
+
+
+def _countHedge(event):
+    metrics.increment("solr_hedges", event)
+
+
+def _recording(lang):
+    '''the SOLR_REPLAY recording of a language; without a file every query
+       is rejected as not recorded, like by a core without the entity'''
+    with _lock:
+        if lang not in _recordings:
+            fname = SOLR_REPLAY % lang
+            if not os.path.exists(fname):
+                fname = None
+            _recordings[lang] = solr.SolrRecording(fname)
+        return _recordings[lang]
+
+
+def _cache(lang):
+    cache = _caches.get(lang)
+    if cache is None:
+        with _lock:
+            cache = _caches.setdefault(lang, dict())
+    return cache
+
+
+def _candidateCache(lang):
+    '''cache key -> scored candidates of the strings linked collectively'''
+    cache = _candidateCaches.get(lang)
+    if cache is None:
+        with _lock:
+            cache = _candidateCaches.setdefault(lang, dict())
+    return cache
+
+
+def _negativeCache(lang):
+    cache = _negativeCaches.get(lang)
+    if cache is None:
+        with _lock:
+            cache = _negativeCaches.setdefault(lang, dict())
+    return cache
+
+
+def _expired(f):
+    return f.created < time.time() - NEGATIVE_FILTER_MAX_AGE
+
+
+def _negativeFilter(lang):
+    '''the Bloom filter of unlinkable strings of a language, loaded on first
+       use and replaced when it expires'''
+    f = _negativeFilters.get(lang)
+    if f is None or _expired(f):
+        with _lock:
+            f = _negativeFilters.get(lang)
+            if f is None or _expired(f):
+                fname = NEGATIVE_FILTER % lang
+                f = None
+                if os.path.exists(fname):
+                    f = bloom.BloomFilter.load(fname)
+                if f is None or _expired(f):
+                    f = bloom.BloomFilter(NEGATIVE_FILTER_CAPACITY, NEGATIVE_FILTER_ERROR_RATE)
+                _negativeFilters[lang] = f
+    return f
+
+
+def saveNegativeFilters():
+    '''write the Bloom filters of unlinkable strings to NEGATIVE_FILTER,
+       adding the strings other processes saved there meanwhile; also done
+       when the interpreter exits'''
+    with _lock:
+        for lang, f in _negativeFilters.items():
+            if _expired(f):
+                continue
+            fname = NEGATIVE_FILTER % lang
+            # one process at a time reads, merges and replaces the file
+            lock = open(fname + ".lock", "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.exists(fname):
+                    saved = bloom.BloomFilter.load(fname)
+                    if (saved.bits, saved.hashes) == (f.bits, f.hashes) and not _expired(saved):
+                        f.update(saved)
+                f.save(fname)
+            finally:
+                lock.close()
+
+atexit.register(saveNegativeFilters)
+
+
+def closeRecordings():
+    '''finish the SOLR_RECORD files; also done when the interpreter exits'''
+    with _lock:
+        for recorder in _recorders.values():
+            recorder.close()
+        _recorders.clear()
+
+atexit.register(closeRecordings)
+
+
+def _pageLinks():
+    '''the page links of PAGE_LINKS, shared by all languages, loaded on first use'''
+    global _links
+    if _links is None:
+        with _lock:
+            if _links is None:
+                _links = pagelinks.PageLinks.load(PAGE_LINKS)
+    return _links
+
+
+def _exactLabels(lang):
+    '''normalized label -> (link, main label, schema.org types or None) for
+       a language, loaded on first use'''
+    exact = _exactMaps.get(lang)
+    if exact is None:
+        with _lock:
+            exact = _exactMaps.get(lang)
+            if exact is None:
+                exact = dict()
+                # a language without a map is linked through Solr only
+                if EXACT_LABELS is not None and os.path.exists(EXACT_LABELS % lang):
+                    types = dict()
+                    ins = open(EXACT_LABELS % lang, "r")
+                    for line in ins:
+                        splitted = line.rstrip("\n").decode('utf-8').split("\t")
+                        if len(splitted) > 4:
+                            # one shared tuple per combination of types
+                            t = tuple(splitted[4].split("|"))
+                            exact[splitted[0]] = (splitted[1], splitted[3], types.setdefault(t, t))
+                        else:
+                            exact[splitted[0]] = (splitted[1], splitted[3], None)
+                    ins.close()
+                _exactMaps[lang] = exact
+    return exact
+
+
+def _exactMatch(normalized, lang, schemaType=None):
+    '''the exact label match, unless it is known to be of another type'''
+    exact = _exactLabels(lang).get(normalized)
+    if exact is None:
+        return None
+    if schemaType is not None and exact[2] is not None and schemaType not in exact[2]:
+        return None
+    return exact[0], EXACT_SCORE, exact[1]
+
+
+def _schemaType(typeHint):
+    if not typeHint:
+        return None
+    return TYPE_HINTS.get(typeHint.strip().lower())
+
+
+def _key(namedEntityString, schemaType):
+    '''cache key of an entity string linked with a type'''
+    if schemaType is None:
+        return namedEntityString
+    return namedEntityString + "\t" + schemaType
+
 
-    cleaned = toEscape.rstrip().lstrip()
-    for c in replaceCharacter:
-        cleaned = cleaned.replace(c, '\\' + c)
-    return cleaned
+def _breaker(lang):
+    breaker = _breakers.get(lang)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(lang, CircuitBreaker())
+    return breaker
 
 
-def _cleanedLabel(label):
-    '''remove information in parenthesis, lowercase'''
-    return re.sub(r'\(.*\)', '', label.lower()).rstrip().lstrip()
+def _solr(lang, request):
+    '''run request(connection) against the core of a language, with
+       retries, backoff and the circuit breaker of that core'''
+    breaker = _breaker(lang)
+    if not breaker.allow():
+        metrics.increment("solr_errors", "circuit open")
+        raise SolrUnavailable("dbpedia_%s: circuit open" % lang)
+    delay = RETRY_BACKOFF
+    for attempt in range(RETRIES + 1):
+        try:
+            with _connection(lang) as conn:
+                result = request(conn)
+            breaker.success()
+            return result
+        except solr.SolrException, e:
+            if e.httpcode < 500:
+                metrics.increment("solr_errors", "rejected")
+                raise
+            metrics.increment("solr_errors", "server")
+            error = e
+        except (socket.error, httplib.HTTPException), e:
+            metrics.increment("solr_errors", "connection")
+            error = e
+        breaker.failure()
+        if attempt == RETRIES or not breaker.allow():
+            break
+        metrics.increment("solr_retries", "")
+        time.sleep(delay)
+        delay *= 2
+    metrics.increment("solr_errors", "unavailable")
+    raise SolrUnavailable("dbpedia_%s: %s" % (lang, error))
+
+
+def _degraded(namedEntityString, lang):
+    if fallback is not None:
+        return fallback(namedEntityString, lang)
+    return None
+
+
+_decode = json.JSONDecoder().decode
+
+
+def _parseCandidates(result):
+    '''maximum score and candidate documents of a compact JSON response'''
+    response = _decode(result)["response"]
+    return response.get("maxScore", 0.0), response["docs"]
 
 
 def _stringSimilarity(a, b):
@@ -50,36 +465,390 @@ def _stringSimilarity(a, b):
         return 0.0
 
 
-def disambiguateList(entityStrings):
+def _phrase(normalized):
+    return "\"" + normalized.replace("\\", "\\\\").replace("\"", "\\\"") + "\""
+
+
+def _encodedFormat(text):
+    '''URL encoded text, keeping its %(name)s placeholders'''
+    parts = re.split(r"(%\(\w+\)s)", text)
+    return "".join([i % 2 and part or urllib.quote_plus(part).replace("%", "%%")
+                    for i, part in enumerate(parts)])
+
+
+def _queryTemplates(lang, schemaType=None):
+    '''(candidate query template, /rank query template, format of the
+       query string, field prefixes of its terms) for a language and
+       optionally a schema.org type, built and URL encoded on first use'''
+    templates = _templates.get((lang, schemaType))
+    if templates is None:
+        # the cleaned entity string as a phrase and as terms on the labels and
+        # redirect labels; the normalized fields also match labels that differ
+        # in accents or qualifiers only
+        query = _encodedFormat("  \t\t((label_" + lang + ":\"%(cleaned)s\"^2000 %(labelTerms)s) OR "
+                               "(redirectLabel:\"%(cleaned)s\"^2000 %(redirectTerms)s) OR "
+                               "(label_" + lang + "_normalized:%(normalized)s^2000 "
+                               "redirectLabel_normalized:%(normalized)s^2000))"
+                               "                 AND _val_:inlinks^10"
+                               "                 AND (schemaorgtype:Person^10 OR schemaorgtype:Place OR schemaorgtype:Organization)")
+        fq = "schemaorgtype:Person OR schemaorgtype:Place OR schemaorgtype:Organization"
+        if schemaType is not None:
+            # the query and its boosts stay the same, so candidates of the
+            # type score as without the filter
+            fq = "schemaorgtype:" + schemaType
+        candidate = solr.QueryTemplate(fq=fq,
+                                       fl=CANDIDATE_FIELDS % {"lang": lang},
+                                       rows=CANDIDATE_ROWS,
+                                       omitHeader="true",
+                                       wt="json")
+        # the /rank handler returns the best candidate only
+        rank = solr.QueryTemplate(qt="/rank",
+                                  fq=fq,
+                                  fl="id,label_" + lang + ",score,similarity:strdist($ne,$lf,jw)",
+                                  lf="label_" + lang + "_normalized",
+                                  rows=1,
+                                  omitHeader="true",
+                                  wt="json")
+        with _lock:
+            templates = _templates.setdefault((lang, schemaType), (
+                candidate, rank, query,
+                urllib.quote_plus("label_" + lang + ":"), urllib.quote_plus("redirectLabel:")))
+    return templates
+
+
+def _queries(cleaned, normalized, lang, schemaType=None):
+    '''Solr parameters of the queries for a cleaned entity string; only the
+       entity string is URL encoded per call'''
+    candidate, rank, query, labelField, redirectField = _queryTemplates(lang, schemaType)
+    quoted = urllib.quote_plus(cleaned.encode('utf-8'))
+    # spaces are encoded as "+", escaped "+" as "%5C%2B"
+    terms = quoted.split("+")
+    phrase = urllib.quote_plus(_phrase(normalized).encode('utf-8'))
+    q = solr.Encoded(query % {"cleaned": quoted,
+                              "labelTerms": "+".join([labelField + term for term in terms]),
+                              "redirectTerms": "+".join([redirectField + term for term in terms]),
+                              "normalized": phrase})
+    queries = []
+    if RANKING != "server":
+        queries.append(dict(template=candidate, q=q))
+    if RANKING != "client":
+        queries.append(dict(template=rank, q=q, ne=solr.Encoded(phrase)))
+    return queries
+
+
+def _match(normalized, responses, lang, candidates=None):
+    '''(link, score, main label) from the responses to _queries; with the
+       client ranking, the scored candidates are appended to candidates'''
+    if RANKING == "server":
+        return _rankedMatch(responses[0], lang)
+    match = _bestMatch(normalized, responses[0], lang, candidates)
+    if RANKING == "compare":
+        if _rankedMatch(responses[1], lang)[0] == match[0]:
+            rankingComparison["same"] += 1
+        else:
+            rankingComparison["different"] += 1
+    return match
+
+
+def _coherent(scored, resolved):
+    '''(link, score, main label) of the strings of a page with more than one
+       candidate, chosen by their scores and their coherence with the page.
+       scored maps strings to their (score, link, main label) candidates,
+       resolved maps the other strings of the page to their link.'''
+    links = _pageLinks()
+    deadline = _clock() + COHERENCE_BUDGET
+    # the entities of the page: index -> [(string, weight)]
+    nodes = dict()
+    for s, candidates in scored.iteritems():
+        total = sum([score for score, link, label in candidates])
+        for score, link, label in candidates:
+            i = links.index.get(link)
+            if i is not None:
+                nodes.setdefault(i, []).append((s, score / total))
+    for s, link in resolved.iteritems():
+        i = links.index.get(link)
+        if i is not None:
+            nodes.setdefault(i, []).append((s, 1.0))
+    others = max(1, len(scored) + len(resolved) - 1)
+
+    result = dict()
+    for s, candidates in scored.iteritems():
+        if len(candidates) < 2:
+            continue
+        if _clock() > deadline:
+            if TIMING:
+                metrics.increment("coherence", "budget")
+            break
+        best = None
+        for score, link, label in candidates:
+            # the strongest support by each other string
+            support = dict()
+            i = links.index.get(link)
+            if i is not None:
+                for j in links.related(i, nodes):
+                    for other, weight in nodes[j]:
+                        if other != s and weight > support.get(other, 0.0):
+                            support[other] = weight
+            coherence = sum(support.itervalues()) / others
+            total = (1 - COHERENCE_WEIGHT) * score + COHERENCE_WEIGHT * coherence
+            if best is None or total > best[0]:
+                best = (total, (link, score, label))
+        result[s] = best[1]
+        if TIMING and best[1][0] != candidates[0][1]:
+            metrics.increment("coherence", "changed")
+    return result
+
+
+def _timed(phase, start, name="phase_seconds"):
+    '''record the time since start for a phase, returns the current time'''
+    now = _clock()
+    metrics.observe(name, phase, now - start)
+    return now
+
+
+def _outcome(match):
+    if match is None:
+        return "miss"
+    if match[0] is None:
+        return "negative"
+    return "hit"
+
+
+def _rankedMatch(result, lang):
+    '''the best candidate as ranked by the /rank handler, scored by the
+       similarity of its main label (see RANKING)'''
+    t = TIMING and _clock()
+    docs = _parseCandidates(result)[1]
+    if t:
+        _timed("parse", t)
+        metrics.observe("candidates", "", len(docs), metrics.COUNT_BUCKETS)
+    if not docs:
+        return None, -1.0, None
+    similarity = docs[0].get("similarity", 0.0)
+    label = docs[0].get("label_" + lang)
+    if similarity > CUTOFF_SIMILARITY:
+        return docs[0].get("id"), similarity, label
+    else:
+        return None, -1.0, label
+
+
+def _cleaned(namedEntityString):
+    return _escapeQueryString(unicode(namedEntityString.decode('utf-8').lower()))
+
+
+def _cached(key, lang):
+    '''remembered (link, score, main label) of an entity string or None'''
+    match = _cache(lang).get(key)
+    if match is not None:
+        return match
+    negative = _negativeCache(lang).get(key)
+    if negative is not None:
+        if negative[0] > time.time():
+            return negative[1]
+        # expired, look it up again even if the filter has it
+        _negativeCache(lang).pop(key, None)
+        return None
+    if NEGATIVE_FILTER is not None and key in _negativeFilter(lang):
+        # rechecked after NEGATIVE_CACHE_TTL like any other negative
+        return _remember(key, (None, -1.0, None), lang)
+    return None
+
+
+def _remember(key, match, lang, candidates=None):
+    '''cache the match of an entity string, and the candidates it was chosen
+       from for collective linking'''
+    if match[0] is None:
+        cache = _negativeCache(lang)
+        if len(cache) >= NEGATIVE_CACHE_SIZE:
+            cache.clear()
+        cache[key] = (time.time() + NEGATIVE_CACHE_TTL, match)
+        if NEGATIVE_FILTER is not None:
+            _negativeFilter(lang).add(key)
+        return match
+    cache = _cache(lang)
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+        _candidateCache(lang).clear()
+    cache[key] = match
+    if candidates is not None:
+        _candidateCache(lang)[key] = candidates
+    return match
+
+
+def initialize(languages=None, connect=False):
+    '''load what the linking of the languages (default LANGUAGES) would
+       otherwise load on first use: the character mapping, the page links,
+       the exact label maps, the negative filters and the replayed
+       recordings. With
+       connect, also query each Solr core once, which raises SolrUnavailable
+       if it cannot be reached. Call it without connect before forking
+       workers, so they share the loaded data and do not share
+       connections.'''
+    normalize.initialize()
+    if PAGE_LINKS is not None:
+        _pageLinks()
+    for lang in languages or LANGUAGES:
+        if lang not in LANGUAGES:
+            raise ValueError("Unsupported language: %s" % lang)
+        _exactLabels(lang)
+        if NEGATIVE_FILTER is not None:
+            _negativeFilter(lang)
+        if SOLR_REPLAY is not None:
+            _recording(lang)
+        if connect:
+            _solr(lang, lambda conn: conn.raw_query(q="*:*", rows=0, omitHeader="true", wt="json"))
+
+
+def disambiguateList(entityStrings, lang=LANG, typeHints=None):
+    '''link a set of entity strings, e.g. those of one page; the Solr
+       queries of all uncached strings are pipelined over one connection.
+       typeHints maps entity strings to a type hint (see TYPE_HINTS).'''
+    if lang not in LANGUAGES:
+        raise ValueError("Unsupported language: %s" % lang)
+    strings = set(entityStrings)
+    collective = PAGE_LINKS is not None and RANKING != "server" and len(strings) > 1
     result = dict()
-    for s in set(entityStrings):
-        result[s] = linkEntity(s)
+    # the candidates of the strings reranked by their coherence
+    scored = dict()
+    pending = []
+    t = TIMING and _clock()
+    for s in strings:
+        schemaType = _schemaType(typeHints and typeHints.get(s))
+        result[s] = _cached(_key(s, schemaType), lang)
+        if collective and result[s] is not None and result[s][0] is not None:
+            # cached links are reranked with the page as well; those cached
+            # without their candidates are looked up again
+            candidates = _candidateCache(lang).get(_key(s, schemaType))
+            if candidates is None:
+                result[s] = None
+            else:
+                scored[s] = candidates
+        if result[s] is None:
+            normalized = normalize.normalizedLabel(s)
+            exact = _exactMatch(normalized, lang, schemaType)
+            if exact is not None:
+                result[s] = _remember(_key(s, schemaType), exact, lang)
+                if t:
+                    metrics.increment("lookups", "exact")
+            else:
+                pending.append((s, _cleaned(s), normalized, schemaType))
+                if t:
+                    metrics.increment("lookups", "miss")
+        elif t:
+            metrics.increment("lookups", _outcome(result[s]))
+    if t:
+        t = _timed("cache", t, "batch_phase_seconds")
+    if pending:
+        if not _linkPending(pending, result, scored, collective, lang, typeHints):
+            return result
+    if scored:
+        # links of the strings not reranked, the context of the others
+        resolved = dict((s, match[0]) for s, match in result.iteritems()
+                        if match is not None and match[0] is not None and s not in scored)
+        t = TIMING and _clock()
+        result.update(_coherent(scored, resolved))
+        if t:
+            _timed("coherence", t, "batch_phase_seconds")
     return result
 
 
-def linkEntity(namedEntityString):
-    cleaned = _escapeQueryString(unicode(namedEntityString.decode('utf-8').lower()))
-    labelQuery = "label_" + LANG + ":\"" + cleaned + "\"^2000 " + " ".join(["label_" + LANG + ":" + elt for elt in cleaned.split(" ")])
-    redirectLabelQuery="redirectLabel:\"" +cleaned + "\"^2000 " + " ".join(["redirectLabel:"+elt for elt in cleaned.split(" ")])
+def _linkPending(pending, result, scored, collective, lang, typeHints):
+    '''query Solr for the pending strings of disambiguateList and put their
+       matches into result and, in collective mode, their candidates into
+       scored; returns False if they were linked one by one or degraded'''
+    t = TIMING and _clock()
+    perEntity = RANKING == "compare" and 2 or 1
+    queries = [q for s, cleaned, normalized, schemaType in pending
+               for q in _queries(cleaned, normalized, lang, schemaType)]
+    if t:
+        t = _timed("query", t, "batch_phase_seconds")
+    try:
+        responses = _solr(lang, lambda conn: conn.raw_query_many(queries))
+        if t:
+            t = _timed("solr", t, "batch_phase_seconds")
+    except SolrUnavailable, e:
+        for s, cleaned, normalized, schemaType in pending:
+            result[s] = _degraded(s, lang)
+            if result[s] is None:
+                raise e
+        return False
+    except solr.SolrException, e:
+        # one of the queries was rejected, link the strings one by one
+        for s, cleaned, normalized, schemaType in pending:
+            result[s] = linkEntity(s, lang, typeHints and typeHints.get(s))
+        return False
+
+    for i, (s, cleaned, normalized, schemaType) in enumerate(pending):
+        candidates = None
+        if collective:
+            candidates = []
+        match = _match(normalized, responses[i * perEntity:(i + 1) * perEntity], lang, candidates)
+        if candidates:
+            # best first, ties in the order the match was chosen in
+            candidates.sort(key=lambda c: -c[0])
+            candidates = scored[s] = candidates[:COHERENCE_CANDIDATES]
+        # the cache keeps the match of the string on its own
+        result[s] = _remember(_key(s, schemaType), match, lang, candidates)
+    if t:
+        _timed("scoring", t, "batch_phase_seconds")
+    return True
+
+
+def linkEntity(namedEntityString, lang=LANG, typeHint=None):
+    '''best (link, score, main label) for an entity string, of the
+       schema.org type of typeHint if it is one of TYPE_HINTS; raises
+       SolrUnavailable if Solr cannot be queried and there is no fallback'''
+    if lang not in LANGUAGES:
+        raise ValueError("Unsupported language: %s" % lang)
+    t = TIMING and _clock()
+    schemaType = _schemaType(typeHint)
+    key = _key(namedEntityString, schemaType)
+    cached = _cached(key, lang)
+    if t:
+        t = _timed("cache", t)
+    if cached is not None:
+        if t:
+            metrics.increment("lookups", _outcome(cached))
+        return cached
+
+    normalized = normalize.normalizedLabel(namedEntityString)
+    exact = _exactMatch(normalized, lang, schemaType)
+    if t:
+        t = _timed("exact", t)
+        metrics.increment("lookups", exact is None and "miss" or "exact")
+    if exact is not None:
+        return _remember(key, exact, lang)
+
+    queries = _queries(_cleaned(namedEntityString), normalized, lang, schemaType)
+    if t:
+        t = _timed("query", t)
     try:
-        result = s.raw_query(q="\
-  		(("+labelQuery+") OR ("+redirectLabelQuery+")) \
-                AND _val_:inlinks^10 \
-                AND (schemaorgtype:Person^10 OR schemaorgtype:Place OR schemaorgtype:Organization)",
-                fq="schemaorgtype:Person OR schemaorgtype:Place OR schemaorgtype:Organization",
-                fl="* score",
-                rows=5,
-                indent="on",
-                wt="json")
-    except Exception, e:
+        responses = _solr(lang, lambda conn: [conn.raw_query(**q) for q in queries])
+        if t:
+            _timed("solr", t)
+    except SolrUnavailable, e:
+        match = _degraded(namedEntityString, lang)
+        if match is None:
+            raise e
+        return match
+    except solr.SolrException, e:
         print e
-        return None
+        return None, -1.0, None
+
+    return _remember(key, _match(normalized, responses, lang), lang)
 
+
+def _bestMatch(normalized, result, lang, candidates=None):
+    '''score the candidates of a Solr response against the normalized entity
+       string; appends (score, link, main label) of every candidate above
+       the cutoff to candidates'''
     bestMatch = None
     bestMatchMainLabel = None
 
-    jsonResult = json.loads(result)
-    maxScore = jsonResult["response"]["maxScore"]
+    t = TIMING and _clock()
+    maxScore, docs = _parseCandidates(result)
+    if t:
+        t = _timed("parse", t)
 
     score = -1.0
     sumScore = 0.0
@@ -87,38 +856,53 @@ def linkEntity(namedEntityString):
     sumLabels = dict()
     mainLabels = dict()
 
-    for d in jsonResult["response"]["docs"]:
+    for d in docs:
         if (d.get("score")/maxScore) > CUTOFF_RELEVANCY:
             sumScore += d.get("score")
-            labels = d.get("redirectLabel")
+            labels = d.get("redirectLabel_normalized")
 
             if labels is None:
-                labels = []
+                # an index without the normalized fields
+                labels = [normalize.normalizedLabel(l) for l in d.get("redirectLabel", [])]
 
-            mainLabels[d.get("id")] = d.get("label_" + LANG)
-            sumLabels[d.get("id")] = [(_cleanedLabel(d.get("label_" + LANG)),
-                                      d.get("score"))]
+            mainLabels[d.get("id")] = d.get("label_" + lang)
+            sumLabels[d.get("id")] = []
+            mainLabel = d.get("label_" + lang + "_normalized")
+            if mainLabel is None and mainLabels[d.get("id")] is not None:
+                mainLabel = normalize.normalizedLabel(mainLabels[d.get("id")])
+            if mainLabel is not None:
+                sumLabels[d.get("id")].append((mainLabel, d.get("score")))
 
         for l in labels:
-            sumLabels[d.get("id")].append((_cleanedLabel(l), d.get("score")))
+            sumLabels[d.get("id")].append((l, d.get("score")))
 
     for d in sumLabels.keys():
+        candidateScore = -1.0
         for l in sumLabels.get(d):
-            similarityScore = _stringSimilarity(cleaned, l[0])
+            similarityScore = _stringSimilarity(normalized, l[0])
 
             if similarityScore > CUTOFF_SIMILARITY:
                 relativeRelevancyScore = l[1] / sumScore
                 labelScore = similarityScore * math.sqrt(relativeRelevancyScore)
+                candidateScore = max(candidateScore, labelScore)
 
                 if labelScore > score:
                     bestMatch = d
                     bestMatchMainLabel=mainLabels[d]
                     score=labelScore
 
+        if candidates is not None and candidateScore > CUTOFF_TOTAL_SCORE:
+            candidates.append((candidateScore, d, mainLabels[d]))
+
+    if t:
+        _timed("scoring", t)
+        metrics.observe("candidates", "", len(docs), metrics.COUNT_BUCKETS)
+        metrics.observe("labels", "", sum(len(l) for l in sumLabels.itervalues()), metrics.COUNT_BUCKETS)
+
     if score > CUTOFF_TOTAL_SCORE:
         return bestMatch, score, bestMatchMainLabel
     else:
         return None, -1.0, bestMatchMainLabel
 
 if __name__ == '__main__':
-    print linkEntity(sys.argv[1])
+    print linkEntity(*sys.argv[1:3])
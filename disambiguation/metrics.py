@@ -0,0 +1,162 @@
+import sys
+import bisect
+import threading
+
+# Upper bounds of the histogram buckets; values above the last bound are
+# counted in an extra overflow bucket.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# Names of the label of a metric in the Prometheus output, "label" if
+# not listed.
+LABEL_NAMES = {"phase_seconds": "phase", "batch_phase_seconds": "phase",
+               "lookups": "outcome", "solr_errors": "error",
+               "requests": "status", "request_seconds": "route",
+               "links": "result", "coherence": "outcome",
+               "solr_hedges": "event"}
+
+_histograms = dict()
+_counters = dict()
+_gauges = dict()
+_lock = threading.Lock()
+
+
+class Histogram(object):
+    '''number of observed values per bucket, with their count and sum'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        '''upper bound of the bucket holding the q-quantile, None if empty
+           or in the overflow bucket'''
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if n and seen >= rank:
+                return bound
+        return None
+
+
+def observe(name, label, value, buckets=LATENCY_BUCKETS):
+    '''add a value to the histogram name{label}'''
+    h = _histograms.get((name, label))
+    if h is None:
+        with _lock:
+            h = _histograms.setdefault((name, label), Histogram(buckets))
+    h.observe(value)
+
+
+def increment(name, label, n=1):
+    '''add n to the counter name{label}'''
+    with _lock:
+        _counters[(name, label)] = _counters.get((name, label), 0) + n
+
+
+def setGauge(name, label, value):
+    '''set the gauge name{label}'''
+    with _lock:
+        _gauges[(name, label)] = value
+
+
+def adjustGauge(name, label, delta):
+    '''add delta to the gauge name{label}'''
+    with _lock:
+        _gauges[(name, label)] = _gauges.get((name, label), 0) + delta
+
+
+def histograms():
+    '''sorted ((name, label), Histogram) pairs'''
+    with _lock:
+        return sorted(_histograms.items())
+
+
+def counters():
+    '''sorted ((name, label), value) pairs'''
+    with _lock:
+        return sorted(_counters.items())
+
+
+def gauges():
+    '''sorted ((name, label), value) pairs'''
+    with _lock:
+        return sorted(_gauges.items())
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def _bound(value):
+    return value is None and "inf" or "%g" % value
+
+
+def dump(out=sys.stderr):
+    '''write a summary of all histograms and counters'''
+    out.write("%-28s %8s %12s %10s %10s\n" % ("histogram", "count", "mean", "p50 <=", "p99 <="))
+    for (name, label), h in histograms():
+        if h.count:
+            out.write("%-28s %8d %12.6g %10s %10s\n" % (
+                name + (label and "{" + label + "}" or ""), h.count, h.sum / h.count,
+                _bound(h.quantile(0.5)), _bound(h.quantile(0.99))))
+    for (name, label), value in counters() + gauges():
+        out.write("%-28s %8d\n" % (name + (label and "{" + label + "}" or ""), value))
+
+
+def _labels(name, label, le=None):
+    pairs = []
+    if label:
+        value = label.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append('%s="%s"' % (LABEL_NAMES.get(name, "label"), value))
+    if le is not None:
+        pairs.append('le="%s"' % le)
+    return pairs and "{" + ",".join(pairs) + "}" or ""
+
+
+def prometheus(prefix="disambiguation_"):
+    '''all histograms, counters and gauges in the Prometheus text format'''
+    lines = []
+    typed = set()
+
+    def declare(metric, kind):
+        if metric not in typed:
+            typed.add(metric)
+            lines.append("# TYPE %s %s" % (metric, kind))
+
+    for (name, label), h in histograms():
+        metric = prefix + name
+        declare(metric, "histogram")
+        with h.lock:
+            counts, count, total = list(h.counts), h.count, h.sum
+        cumulative = 0
+        for bound, n in zip(h.buckets, counts):
+            cumulative += n
+            lines.append("%s_bucket%s %d" % (metric, _labels(name, label, "%g" % bound), cumulative))
+        lines.append("%s_bucket%s %d" % (metric, _labels(name, label, "+Inf"), count))
+        lines.append("%s_sum%s %r" % (metric, _labels(name, label), total))
+        lines.append("%s_count%s %d" % (metric, _labels(name, label), count))
+    for (name, label), value in counters():
+        metric = prefix + name + "_total"
+        declare(metric, "counter")
+        lines.append("%s%s %d" % (metric, _labels(name, label), value))
+    for (name, label), value in gauges():
+        metric = prefix + name
+        declare(metric, "gauge")
+        lines.append("%s%s %s" % (metric, _labels(name, label), value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,57 @@
+import os
+import re
+import unicodedata
+
+# The character mapping of the label_normalized field type in schema.xml,
+# so labels normalized by make-csv.py, by the Solr analyzer and of the
+# entity strings in disambiguation.py agree.
+MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'solrhome', 'dbpedia', 'conf', 'mapping-FoldToASCII.txt')
+
+_qualifier = re.compile(r'\(.*\)')
+_table = None
+
+
+def _readMapping(fname):
+    '''translate table of a Solr MappingCharFilter file ("\\u00C0" => "A")'''
+    table = dict()
+    ins = open(fname, "r")
+    for line in ins:
+        m = re.match(r'\s*"(.*)"\s*=>\s*"(.*)"\s*$', line)
+        if m is None:
+            continue
+        source = m.group(1).decode('unicode_escape')
+        if len(source) == 1:
+            table[ord(source)] = m.group(2).decode('unicode_escape')
+    ins.close()
+    return table
+
+
+def initialize():
+    '''read the character mapping, otherwise done on first use'''
+    global _table
+    if _table is None:
+        if os.path.exists(MAPPING):
+            _table = _readMapping(MAPPING)
+        else:
+            _table = dict()
+    return _table
+
+
+def foldToAscii(text):
+    '''replace accented and other non-ASCII characters by their ASCII
+       equivalent, falls back to unicode decomposition without the mapping'''
+    table = _table
+    if table is None:
+        table = initialize()
+    if table:
+        return text.translate(table)
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+def normalizedLabel(label):
+    '''ASCII folded, lowercased label without qualifiers in parentheses
+       ("Paris (Texas)" becomes "paris")'''
+    if not isinstance(label, unicode):
+        label = label.decode('utf-8')
+    return _qualifier.sub('', foldToAscii(label)).lower().strip()
@@ -0,0 +1,86 @@
+import array
+import bisect
+import itertools
+
+
+class PageLinks(object):
+    '''Undirected links between the pages of entities in compressed sparse
+       rows: the sorted indexes of the entities linked with entity i are
+       neighbours[offsets[i]:offsets[i + 1]], ids[i] is its id'''
+
+    def __init__(self, ids, offsets, neighbours):
+        self.ids = ids
+        self.index = dict((id, i) for i, id in enumerate(ids))
+        self.offsets = offsets
+        self.neighbours = neighbours
+
+    def linked(self, i, j):
+        end = self.offsets[i + 1]
+        k = bisect.bisect_left(self.neighbours, j, self.offsets[i], end)
+        return k < end and self.neighbours[k] == j
+
+    def related(self, i, nodes):
+        '''those of nodes (a set or dict of entity indexes) linked with entity
+           i, looked up in the smaller of the two'''
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if end - start <= len(nodes):
+            return [j for j in self.neighbours[start:end] if j in nodes]
+        return [j for j in nodes if self.linked(i, j)]
+
+    def save(self, prefix):
+        out = open(prefix + ".ids", "w")
+        for id in self.ids:
+            out.write(id + "\n")
+        out.close()
+        out = open(prefix + ".links", "wb")
+        array.array('I', [len(self.offsets), len(self.neighbours)]).tofile(out)
+        self.offsets.tofile(out)
+        self.neighbours.tofile(out)
+        out.close()
+
+    @classmethod
+    def load(cls, prefix):
+        ins = open(prefix + ".ids", "r")
+        ids = [line.rstrip("\n") for line in ins]
+        ins.close()
+        ins = open(prefix + ".links", "rb")
+        sizes = array.array('I')
+        sizes.fromfile(ins, 2)
+        offsets = array.array('I')
+        offsets.fromfile(ins, sizes[0])
+        neighbours = array.array('I')
+        neighbours.fromfile(ins, sizes[1])
+        ins.close()
+        return cls(ids, offsets, neighbours)
+
+
+def build(ids, pairs):
+    '''PageLinks of the entities ids from (index, index) pairs of linked
+       entities, in both directions, without duplicates and self links'''
+    sources = array.array('I')
+    targets = array.array('I')
+    for a, b in pairs:
+        if a != b:
+            sources.append(a)
+            targets.append(b)
+            sources.append(b)
+            targets.append(a)
+    # counting sort by source
+    offsets = array.array('I', [0]) * (len(ids) + 1)
+    for a in sources:
+        offsets[a + 1] += 1
+    for i in xrange(len(ids)):
+        offsets[i + 1] += offsets[i]
+    unsorted = array.array('I', [0]) * len(sources)
+    fill = offsets[:-1]
+    for a, b in itertools.izip(sources, targets):
+        unsorted[fill[a]] = b
+        fill[a] += 1
+    del sources, targets, fill
+
+    neighbours = array.array('I')
+    compact = array.array('I', [0])
+    for i in xrange(len(ids)):
+        neighbours.extend(sorted(set(unsorted[offsets[i]:offsets[i + 1]])))
+        compact.append(len(neighbours))
+    return PageLinks(ids, compact, neighbours)
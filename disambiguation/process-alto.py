@@ -3,7 +3,11 @@ import sys
 import xml.etree.ElementTree as ET
 import collections
 import disambiguation
+import profiler
 # Usage python SOURCE-DIRECTORY-WITH-ALTOS OUTPUT-DIRECTORY LANGUAGE
+#
+# With PROFILE_DIR set in the environment, kill -USR1 writes a profile of
+# the next profiler.PROFILE_SECONDS seconds to that directory.
 
 
 def processDir(sourceDir, targetDir, language="en"):
@@ -19,12 +23,22 @@ def processDir(sourceDir, targetDir, language="en"):
             print outputfname
             tree = ET.parse(fname)
             entities = dict()
+            types = collections.defaultdict(set)
             for t in tree.getroot().iter(tag="{http://www.loc.gov/standards/alto/ns-v2#}NamedEntityTag"):
                 if entities.get(t.attrib.get('LABEL')) is None:
                     entities[t.attrib.get('LABEL')] = []
                 entities.get(t.attrib.get('LABEL')).append(t)
+                types[t.attrib.get('LABEL')].add(t.attrib.get('TYPE'))
+            # the TYPE restricts the candidates, unless a label is tagged
+            # with different types on the page
+            typeHints = dict((label, list(ts)[0]) for label, ts in types.iteritems() if len(ts) == 1)
 
-            result = disambiguation.disambiguateList(entities.keys())
+            try:
+                result = disambiguation.disambiguateList(entities.keys(), language, typeHints)
+            except disambiguation.SolrUnavailable, e:
+                # leave the file unwritten, so a rerun picks it up
+                print "skipped:", e
+                continue
             for key in result.keys():
                 if result.get(key) is not None and result.get(key)[0] is not None:
                     for tag in entities[key]:
@@ -33,4 +47,6 @@ def processDir(sourceDir, targetDir, language="en"):
                 outputfname, xml_declaration=True, encoding='utf-8', method='xml')
 
 if __name__ == '__main__':
+    profiler.install()
+    disambiguation.initialize([sys.argv[3]])
     processDir(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import signal
+import threading
+from collections import defaultdict
+
+# Directory for the profiles; profiling is only possible when it is set
+# (environment variable PROFILE_DIR), see install().
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_SECONDS = 30
+INTERVAL = 0.005
+
+_running = threading.Lock()
+
+
+def _frameName(frame):
+    code = frame.f_code
+    return "%s:%s" % (os.path.splitext(os.path.basename(code.co_filename))[0], code.co_name)
+
+
+class Sampler(object):
+    '''Statistical profiler: looks at the stacks of all other threads every
+       interval seconds and counts how often each stack was seen'''
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self.samples = 0
+
+    def sample(self):
+        own = threading.current_thread().ident
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frameName(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, "thread-%d" % ident))
+            self.counts[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            self.sample()
+            time.sleep(self.interval)
+
+    def write(self, out):
+        '''collapsed stacks, one "frame;frame;... count" line per stack, as
+           read by flamegraph.pl and speedscope'''
+        for stack, count in sorted(self.counts.iteritems()):
+            out.write("%s %d\n" % (stack, count))
+
+
+def profile(seconds=None, fname=None):
+    '''sample all threads for seconds (default PROFILE_SECONDS) in the
+       background and write the collapsed stacks to fname (default: a new
+       file in PROFILE_DIR); returns fname, or None if a profile is
+       already running'''
+    if not _running.acquire(False):
+        return None
+    seconds = seconds or PROFILE_SECONDS
+    if fname is None:
+        fname = os.path.join(PROFILE_DIR or ".", "profile-%d-%s.collapsed" % (
+            os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+
+    def run():
+        try:
+            sampler = Sampler()
+            sampler.run(seconds)
+            out = open(fname, "w")
+            sampler.write(out)
+            out.close()
+        finally:
+            _running.release()
+    t = threading.Thread(target=run, name="profiler")
+    t.daemon = True
+    t.start()
+    return fname
+
+
+def install(signum=signal.SIGUSR1):
+    '''if PROFILE_DIR is set, profile for PROFILE_SECONDS when the process
+       receives signum; returns whether profiling is enabled'''
+    if PROFILE_DIR is None:
+        return False
+    signal.signal(signum, lambda signum, frame: profile())
+    # let interrupted reads and writes continue instead of failing
+    signal.siginterrupt(signum, False)
+    return True
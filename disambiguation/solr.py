@@ -55,6 +55,24 @@ Only `url` is required,.
     http_user, http_pass -- If given, include HTTP Basic authentication
         in all request headers.
 
+    update_format -- Body format used by add() and add_many(): 'xml'
+        (the default) or 'json'.  The JSON body is generated lazily and
+        sent with chunked transfer encoding, so memory use does not grow
+        with the number of documents.
+
+    response_format -- Response format requested by query(): 'xml'
+        (the default) or 'json'.  Both return the same Response objects;
+        parsing JSON is considerably cheaper for large result pages.
+
+    gzip -- Ask Solr for gzip compressed query responses
+        (Accept-Encoding: gzip).  Defaults to false.
+
+    pipeline_depth -- Maximum number of queries raw_query_many() sends
+        on the connection before reading their responses.  Defaults to 8.
+
+    recorder -- A SolrRecorder the queries and their raw responses are
+        written to, see "Record and Replay" below.
+
 Once created, a connection object has the following public methods:
 
     query(q, fields=None, highlight=None,
@@ -136,6 +154,17 @@ Once created, a connection object has the following public methods:
 
             Issue an optimize command.
 
+    query_cursor(q, rows=1000, sort=None, cursor_mark='*',
+                 prefetch=True, **params)
+
+            Stream the complete result set of a query page by page using
+            Solr's cursorMark deep paging (Solr 4.7+).  Yields a Response
+            per page; `response.nextCursorMark` can be saved and passed
+            back as `cursor_mark` to resume after that page.  Only the
+            current and the next page are held in memory.  With
+            `prefetch`, the next page is fetched in a background thread
+            while the current one is processed.
+
     raw_query(**params)
 
             Send a query command (unprocessed by this library) to
@@ -148,6 +177,26 @@ Once created, a connection object has the following public methods:
             underscores when calling this method. (e.g.,
             hl_simple_post='</pre'>)
 
+            A `qt` parameter starting with '/' sends the query to that
+            request handler instead of /select (e.g., qt='/rank').
+
+            A `template` parameter adds the parameters of a QueryTemplate,
+            which are URL encoded once when the template is created:
+
+                t = QueryTemplate(fq='type:Person', rows=10, wt='json')
+                raw_query(template=t, q='name:einstein')
+
+            Values wrapped in Encoded are URL encoded already and sent as
+            they are (e.g., q=Encoded('name%3Aeinstein')).
+
+    raw_query_many(lst)
+
+            Send several raw queries, each given as a dictionary of
+            parameters like for raw_query(), over the same keep-alive
+            connection using HTTP/1.1 pipelining: up to `pipeline_depth`
+            requests are written before their responses are read.
+            Returns the list of un-parsed results in the same order.
+
     close()
             Close the underlying HTTP(S) connection.
 
@@ -209,6 +258,56 @@ Query Responses
     which will be a dictionary.
 
 
+Load Balancing
+--------------
+
+`BalancedSolrConnection` takes a list of urls of Solr replicas instead
+of a single url, plus the parameters of `SolrConnection`, and offers the
+same query and update methods.  Each request is sent to the node with
+the lowest (outstanding requests + 1) * average latency.  A node that
+fails `max_failures` times in a row is ejected for `eject_time` seconds
+and the request fails over to another node.  Ejected nodes are
+re-admitted when a health probe (the core's /admin/ping handler)
+succeeds; probes run every `probe_interval` seconds in a background
+thread if that is given, and otherwise when the ejection time is over.
+
+With `hedge_percentile` (e.g. 95), a query that takes longer than that
+percentile of the recent query latencies is sent again to a second
+node, and the first answer is used; the slower request is cancelled.
+`SolrBalancer.hedged` and `SolrBalancer.hedges_won` count how often
+that happened and how often the second node answered first; the
+balancer's `observer`, if given, is also called with "hedged" and
+"won" to count them elsewhere, e.g. in a metrics registry.
+
+The node statistics live in a `SolrBalancer`, which can be shared by
+several BalancedSolrConnections (e.g. one per thread):
+
+    >>> balancer = SolrBalancer(['http://solr1:8983/solr/dbpedia',
+    ...                          'http://solr2:8983/solr/dbpedia'])
+    >>> c = BalancedSolrConnection(balancer.urls, balancer=balancer)
+
+
+Record and Replay
+-----------------
+
+A `SolrRecorder` appends every query of the connections it is passed to
+(as `recorder`) with its raw response and duration to a gzip compressed
+file of JSON lines.  `ReplaySolrConnection` answers queries from such
+files instead of a Solr server, after an artificial `latency` (seconds
+per request or pipelined batch) and, with `recorded_latency`, the
+recorded duration.  Queries that were not recorded fail with a 404
+SolrException.
+
+    >>> recorder = SolrRecorder('dbpedia.rec.gz')
+    >>> c = SolrConnection('http://localhost:8983/solr/dbpedia',
+    ...                    recorder=recorder)
+    >>> c.raw_query(q='label_en:einstein', wt='json')
+    >>> recorder.close()
+    >>> r = ReplaySolrConnection('http://localhost:8983/solr/dbpedia',
+    ...                          'dbpedia.rec.gz', latency=0.005)
+    >>> r.raw_query(q='label_en:einstein', wt='json')
+
+
 Quick examples on use:
 ----------------------
 
@@ -246,7 +345,16 @@ import codecs
 import urllib
 import datetime
 import logging
+import json
+import re
+import threading
+import time
+import collections
+import Queue
+import zlib
 from StringIO import StringIO
+from gzip import GzipFile
+from urllib import quote_plus
 from xml.sax import make_parser
 from xml.sax.handler import ContentHandler
 from xml.sax.saxutils import escape, quoteattr
@@ -255,7 +363,9 @@ from xml.dom.minidom import parseString
 __version__ = "0.9.6"
 
 __all__ = ['SolrException', 'Solr', 'SolrConnection',
-           'Response', 'SearchHandler']
+           'SolrBalancer', 'BalancedSolrConnection',
+           'SolrRecorder', 'SolrRecording', 'ReplaySolrConnection',
+           'Response', 'SearchHandler', 'QueryTemplate', 'Encoded']
 
 _python_version = sys.version_info[0] + (sys.version_info[1] / 10.0)
 
@@ -349,6 +459,11 @@ class Solr:
                  http_pass=None,
                  post_headers={},
                  max_retries=3,
+                 update_format='xml',
+                 response_format='xml',
+                 gzip=False,
+                 pipeline_depth=8,
+                 recorder=None,
                  debug=False):
         """
             url -- URI pointing to the Solr instance. Examples:
@@ -372,6 +487,23 @@ class Solr:
             http_user, http_pass -- If given, include HTTP Basic authentication
                 in all request headers.
 
+            update_format -- 'xml' (the default) or 'json'.  With 'json',
+                add() and add_many() stream the documents to Solr as a
+                chunked JSON array instead of building an XML string.
+
+            response_format -- 'xml' (the default) or 'json'.  With 'json',
+                query() requests wt=json and parses it without building
+                an intermediate XML node tree.
+
+            gzip -- Send Accept-Encoding: gzip with queries and
+                decompress gzip encoded responses.
+
+            pipeline_depth -- Maximum number of requests raw_query_many()
+                has in flight on the connection.
+
+            recorder -- SolrRecorder to write the queries and their raw
+                responses to.
+
         """
 
         self.scheme, self.host, self.path = urlparse.urlparse(url, 'http')[:3]
@@ -385,8 +517,15 @@ class Solr:
         self.ssl_key = ssl_key
         self.ssl_cert = ssl_cert
         self.max_retries = int(max_retries)
+        self.update_format = update_format
+        self.response_format = response_format
+        self.pipeline_depth = int(pipeline_depth)
+        self.recorder = recorder
 
         assert self.max_retries >= 0
+        assert self.update_format in ('xml', 'json')
+        assert self.response_format in ('xml', 'json')
+        assert self.pipeline_depth >= 1
 
         kwargs = {}
 
@@ -420,8 +559,16 @@ class Solr:
         if not self.persistent:
             self.xmlheaders['Connection'] = 'close'
 
+        self.jsonheaders = {'Content-Type': 'application/json; charset=utf-8',
+                            'Transfer-Encoding': 'chunked'}
+        self.jsonheaders.update(post_headers)
+        if not self.persistent:
+            self.jsonheaders['Connection'] = 'close'
+
         self.form_headers = {
             'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
+        if gzip:
+            self.form_headers['Accept-Encoding'] = 'gzip'
 
         if http_user is not None and http_pass is not None:
             http_auth = http_user + ':' + http_pass
@@ -434,7 +581,9 @@ class Solr:
             self.form_headers['Connection'] = 'close'
 
         self.debug = debug
+        self.cancelled = False
         self.select = SearchHandler(self, "/select")
+        self.handlers = {}
 
     def close(self):
         """Close the underlying HTTP(S) connection."""
@@ -492,10 +641,7 @@ class Solr:
 
         Supports commit-control arguments.
         """
-        lst = [u'<add>']
-        self.__add(lst, doc)
-        lst.append(u'</add>')
-        return ''.join(lst)
+        return self._add_body([doc])
 
     @committing
     def add_many(self, docs):
@@ -507,11 +653,7 @@ class Solr:
 
         Supports commit-control arguments.
         """
-        lst = [u'<add>']
-        for doc in docs:
-            self.__add(lst, doc)
-        lst.append(u'</add>')
-        return ''.join(lst)
+        return self._add_body(docs)
 
     def commit(self, wait_flush=True, wait_searcher=True, _optimize=False):
         """
@@ -546,11 +688,23 @@ class Solr:
 
     # Helper methods.
 
+    def _add_body(self, docs):
+        if self.update_format == 'json':
+            return _json_update_chunks(docs)
+        lst = [u'<add>']
+        for doc in docs:
+            self.__add(lst, doc)
+        lst.append(u'</add>')
+        return ''.join(lst)
+
     def _update(self, request, query=None):
         selector = '%s/update%s' % (self.path, qs_from_items(query))
         try:
-            rsp = self._post(selector, request, self.xmlheaders)
-            data = rsp.read()
+            if isinstance(request, basestring):
+                rsp = self._post(selector, request, self.xmlheaders)
+            else:
+                rsp = self._post_chunked(selector, request, self.jsonheaders)
+            data = read_response(rsp)
         finally:
             if not self.persistent:
                 self.close()
@@ -621,7 +775,22 @@ class Solr:
                self.url, self.persistent,
                self.xmlheaders, self.reconnects))
 
+    def cancel(self):
+        """
+        Abort a request running in another thread, without retrying it.
+        The connection must not be used afterwards.
+        """
+        self.cancelled = True
+        sock = self.conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
     def _reconnect(self):
+        if self.cancelled:
+            raise socket.error("request cancelled")
         self.reconnects += 1
         self.close()
         self.conn.connect()
@@ -645,10 +814,93 @@ class Solr:
                     # We include BadStatusLine as they are spurious
                     # and may randomly happen on an otherwise fine
                     # Solr connection (though not often)
+                attempts -= 1
+                if attempts <= 0:
+                    # reconnected on the next request
+                    self.close()
+                    raise
                 self._reconnect()
+
+    def _post_many(self, url, bodies, headers):
+        """
+        POST several bodies to the same url, writing up to
+        `pipeline_depth` requests before reading their responses
+        (HTTP/1.1 pipelining), and return the response bodies in order.
+
+        Requests left unanswered by a connection error, or because the
+        server closed the connection, are sent again on a new connection,
+        like in `_post`.
+        """
+        _headers = self.auth_headers.copy()
+        _headers.update(headers)
+        # The connection has to stay open for the following requests.
+        _headers.pop('Connection', None)
+        head = ['POST %s HTTP/1.1' % url, 'Host: %s' % self.host]
+        head.extend(['%s: %s' % item for item in _headers.items()])
+        head = '\r\n'.join(head)
+
+        results = []
+        attempts = self.max_retries + 1
+        while len(results) < len(bodies):
+            window = bodies[len(results):len(results) + self.pipeline_depth]
+            requests = []
+            for body in window:
+                body = body.encode('UTF-8')
+                requests.append('%s\r\nContent-Length: %d\r\n\r\n%s' % (
+                    head, len(body), body))
+            try:
+                if self.conn.sock is None:
+                    self.conn.connect()
+                self.conn.sock.sendall(''.join(requests))
+                fp = _SharedFile(self.conn.sock.makefile('rb'))
+                for body in window:
+                    rsp = httplib.HTTPResponse(fp, method='POST')
+                    rsp.begin()
+                    try:
+                        results.append(read_response(check_response_status(rsp)))
+                    except SolrException:
+                        # Drop the responses still queued on the connection
+                        self.close()
+                        raise
+                    if rsp.will_close:
+                        self._reconnect()
+                        break
+            except (socket.error,
+                    httplib.ImproperConnectionState,
+                    httplib.BadStatusLine):
                 attempts -= 1
                 if attempts <= 0:
+                    self.close()
                     raise
+                self._reconnect()
+        return results
+
+    def _post_chunked(self, url, chunks, headers):
+        """
+        POST an iterable of byte strings using chunked transfer encoding.
+
+        The body is consumed while it is sent, so unlike `_post` a failed
+        request cannot be replayed; the connection is reset and the error
+        is raised to the caller.
+        """
+        _headers = self.auth_headers.copy()
+        _headers.update(headers)
+        conn = self.conn
+        try:
+            conn.putrequest('POST', url, skip_accept_encoding=True)
+            for key, value in _headers.items():
+                conn.putheader(key, value)
+            conn.endheaders()
+            for chunk in chunks:
+                if chunk:
+                    conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            conn.send('0\r\n\r\n')
+            return check_response_status(conn.getresponse())
+        except (socket.error,
+                httplib.ImproperConnectionState,
+                httplib.BadStatusLine):
+            self._reconnect()
+            raise
 
 
 class SolrConnection(Solr):
@@ -706,13 +958,586 @@ class SolrConnection(Solr):
         return self.select(*args, **params)
 
     def raw_query(self, **params):
-        return self.select.raw(**params)
+        return self._handler(params).raw(**params)
+
+    def raw_query_many(self, queries):
+        # Pipeline the queries per request handler, keeping their order.
+        queries = [dict(params) for params in queries]
+        handlers = [self._handler(params) for params in queries]
+        results = [None] * len(queries)
+        for handler in set(handlers):
+            positions = [i for i, h in enumerate(handlers) if h is handler]
+            data = handler.raw_many([queries[i] for i in positions])
+            for i, result in zip(positions, data):
+                results[i] = result
+        return results
+
+    def _handler(self, params):
+        """
+        Like Solr's legacy request dispatching, a `qt` parameter starting
+        with '/' selects the request handler of a raw query instead of
+        /select.  It is removed from `params`.  The `qt` of a `template`
+        applies unless `params` has its own.
+        """
+        qt = params.get('qt')
+        if qt is None and params.get('template') is not None:
+            qt = params['template'].qt
+        if not qt or not qt.startswith('/'):
+            return self.select
+        params.pop('qt', None)
+        handler = self.handlers.get(qt)
+        if handler is None:
+            handler = self.handlers[qt] = SearchHandler(self, qt)
+        return handler
+
+    def query_cursor(self, q, rows=1000, sort=None, cursor_mark='*',
+                     prefetch=True, **params):
+        """
+        Generate the Response pages of a query over the complete result
+        set, using cursorMark paging instead of start/rows.
+
+        `sort` must result in a total ordering, so the unique key is
+        appended if it is not part of it.  `cursor_mark` is '*' for the
+        first page, or a `nextCursorMark` of an earlier page to resume
+        after it.
+
+        With `prefetch` the next page is requested in a background thread
+        while the caller processes the current one, so the connection
+        must not be used for other requests while iterating.
+        """
+        if not sort:
+            sort = ['id asc']
+        elif isinstance(sort, basestring):
+            sort = [f.strip() for f in sort.split(",")]
+        if 'id' not in [f.split()[0] for f in sort]:
+            sort = list(sort) + ['id asc']
+        params['rows'] = rows
+        params['sort'] = sort
+
+        def fetch(mark):
+            return self.select(q, cursorMark=mark, **params)
+
+        response = fetch(cursor_mark)
+        while response is not None:
+            response.cursorMark = cursor_mark
+            next_mark = getattr(response, 'nextCursorMark', cursor_mark)
+            if next_mark == cursor_mark or not len(response):
+                if len(response):
+                    yield response
+                return
+            if prefetch:
+                pending = _Prefetch(fetch, next_mark)
+                try:
+                    yield response
+                except:
+                    pending.join()
+                    raise
+                response = pending.result()
+            else:
+                yield response
+                response = fetch(next_mark)
+            cursor_mark = next_mark
+
+
+class SolrBalancer(object):
+
+    """
+    Shared request statistics and health of a set of Solr replicas.
+    """
+
+    HEDGE_MIN_SAMPLES = 20
+    """Latencies needed before requests are hedged."""
+
+    HEDGE_REFRESH = 50
+    """New latencies after which the hedging delay is recomputed."""
+
+    def __init__(self, urls, max_failures=3, eject_time=30.0,
+                 probe_interval=None, probe_timeout=1.0, decay=0.3,
+                 window=1000, observer=None):
+        """
+            urls -- list of URIs of Solr instances serving the same index.
+
+            max_failures -- consecutive failures after which a node is
+                ejected.
+
+            eject_time -- seconds an ejected node is left alone before it
+                is probed again.
+
+            probe_interval -- if given, probe ejected nodes every that
+                many seconds in a background thread.
+
+            probe_timeout -- timeout, in seconds, of a health probe.
+
+            decay -- weight of the newest sample in the moving average of
+                the latency.
+
+            window -- number of recent latencies the hedging delay is
+                computed from.
+
+            observer -- if given, called with "hedged" when a request is
+                hedged and with "won" when the hedge answers first.
+        """
+        assert urls
+        self.urls = list(urls)
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.probe_timeout = probe_timeout
+        self.decay = decay
+        self.outstanding = dict([(url, 0) for url in self.urls])
+        self.latency = dict([(url, 0.0) for url in self.urls])
+        self.failures = dict([(url, 0) for url in self.urls])
+        self.ejected = {}
+        self.samples = collections.deque(maxlen=window)
+        self.sampled = 0
+        self.delays = {}
+        self.hedged = 0
+        self.hedges_won = 0
+        self.observer = observer
+        self.lock = threading.Lock()
+        self.probe_interval = probe_interval
+        if probe_interval:
+            prober = threading.Thread(target=self._probe_loop)
+            prober.daemon = True
+            prober.start()
+
+    def choose(self, exclude=()):
+        """
+        Return the url of the node to send the next request to, or None
+        if all nodes are in `exclude`.
+        """
+        now = time.time()
+        due = []
+        with self.lock:
+            candidates = [url for url in self.urls if url not in exclude]
+            if not candidates:
+                return None
+            if not self.probe_interval:
+                due = [url for url in candidates
+                       if self.ejected.get(url, now) < now]
+                for url in due:
+                    # Claim the probe, so concurrent requests skip it.
+                    self.ejected[url] = now + self.eject_time
+        for url in due:
+            self.probe(url)
+        with self.lock:
+            healthy = [url for url in candidates if url not in self.ejected]
+            if not healthy:
+                # Everything is down: try the node that was ejected first.
+                return min(candidates, key=self.ejected.get)
+            return min(healthy, key=lambda url: (
+                (self.outstanding[url] + 1) * self.latency[url]))
+
+    def begin(self, url):
+        with self.lock:
+            self.outstanding[url] += 1
+        return time.time()
+
+    def end(self, url, started, ok=True):
+        elapsed = time.time() - started
+        with self.lock:
+            self.outstanding[url] -= 1
+            if ok:
+                self.failures[url] = 0
+                self.ejected.pop(url, None)
+                self.latency[url] += self.decay * (
+                    elapsed - self.latency[url])
+                self.samples.append(elapsed)
+                self.sampled += 1
+            else:
+                self.failures[url] += 1
+                if self.failures[url] >= self.max_failures:
+                    self.ejected[url] = time.time() + self.eject_time
+
+    def count_hedge(self, won=False):
+        """
+        Count a hedged request, or with `won` one the hedge answered.
+        """
+        with self.lock:
+            if won:
+                self.hedges_won += 1
+            else:
+                self.hedged += 1
+        if self.observer is not None:
+            self.observer(won and "won" or "hedged")
+
+    def abandon(self, url):
+        """
+        End a cancelled request without counting it.
+        """
+        with self.lock:
+            self.outstanding[url] -= 1
+
+    def hedge_delay(self, percentile):
+        """
+        Return the latency under which `percentile` percent of the recent
+        successful requests finished, or None if there are too few.
+        """
+        with self.lock:
+            if len(self.samples) < self.HEDGE_MIN_SAMPLES:
+                return None
+            computed = self.delays.get(percentile)
+            if computed is None or (
+                    self.sampled - computed[0] >= self.HEDGE_REFRESH):
+                ordered = sorted(self.samples)
+                index = min(len(ordered) - 1,
+                            int(len(ordered) * percentile / 100.0))
+                computed = (self.sampled, ordered[index])
+                self.delays[percentile] = computed
+            return computed[1]
+
+    def probe(self, url):
+        """
+        Ping a node; re-admit it if it answers, otherwise extend its
+        ejection.
+        """
+        conn = Solr(url, persistent=False, max_retries=0,
+                    timeout=self.probe_timeout)
+        try:
+            SearchHandler(conn, '/admin/ping').raw(wt='json')
+            ok = True
+        except (socket.error, httplib.HTTPException, SolrException):
+            ok = False
+        with self.lock:
+            if ok:
+                self.failures[url] = 0
+                self.ejected.pop(url, None)
+            elif url in self.ejected:
+                self.ejected[url] = time.time() + self.eject_time
+        return ok
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            for url in list(self.ejected):
+                self.probe(url)
+
+
+def _retryable(error):
+    """
+    Whether a request that raised `error` is worth sending to another
+    node (connection errors and server errors, not rejected requests).
+    """
+    if isinstance(error, SolrException):
+        return error.httpcode >= 500
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+
+class BalancedSolrConnection(object):
+
+    """
+    A SolrConnection-like client spreading requests over several Solr
+    replicas, see "Load Balancing" above.
+    """
+
+    def __init__(self, urls, balancer=None, hedge_percentile=None, **params):
+        """
+            urls -- list of URIs of Solr instances serving the same index.
+
+            balancer -- SolrBalancer to share with other connections; by
+                default a new one is created for `urls`.
+
+            hedge_percentile -- if given, send a query to a second node
+                when it takes longer than this percentile of the recent
+                latencies.
+
+        Other parameters are passed to each SolrConnection.
+        """
+        self.balancer = balancer or SolrBalancer(urls)
+        self.hedge_percentile = hedge_percentile
+        self.params = params
+        self.nodes = dict([(url, SolrConnection(url, **params))
+                           for url in urls])
+
+    def _call(self, method, *args, **kw):
+        return self._request(method, args, kw)
+
+    def _request(self, method, args, kw, failover=True, tried=None):
+        tried = list(tried or [])
+        error = SolrException(503, "No Solr node left to try")
+        while True:
+            url = self.balancer.choose(exclude=tried)
+            if url is None or (tried and not failover):
+                raise error
+            tried.append(url)
+            started = self.balancer.begin(url)
+            ok = False
+            try:
+                result = getattr(self.nodes[url], method)(*args, **kw)
+                ok = True
+                return result
+            except SolrException, error:
+                if error.httpcode < 500:
+                    ok = True
+                    raise
+            except (socket.error, httplib.HTTPException), error:
+                pass
+            finally:
+                self.balancer.end(url, started, ok=ok)
+
+    def _hedged(self, method, args, kw):
+        delay = self.hedge_percentile and self.balancer.hedge_delay(
+            self.hedge_percentile)
+        if not delay:
+            return self._request(method, args, kw)
+
+        answers = Queue.Queue()
+        running = [self.balancer.choose()]
+        self._start(running[0], method, args, kw, answers)
+        try:
+            answer = answers.get(timeout=delay)
+        except Queue.Empty:
+            secondary = self.balancer.choose(exclude=running)
+            if secondary is not None:
+                self.balancer.count_hedge()
+                running.append(secondary)
+                self._start(secondary, method, args, kw, answers)
+            answer = answers.get()
+            if len(running) > 1 and _retryable(answer[1]):
+                # Fall back to the other, still running request.
+                answer = answers.get()
+            elif len(running) > 1:
+                self._cancel(running[answer[0] == running[0] and 1 or 0])
+            if answer[0] == secondary and answer[1] is None:
+                self.balancer.count_hedge(won=True)
+
+        url, error, value = answer
+        if error is None:
+            return value
+        if not _retryable(error):
+            raise error
+        return self._request(method, args, kw, tried=running)
+
+    def _start(self, url, method, args, kw, answers):
+        conn = self.nodes[url]
+
+        def run():
+            started = self.balancer.begin(url)
+            value = error = None
+            try:
+                value = getattr(conn, method)(*args, **kw)
+            except Exception, error:
+                # Whatever it is, _hedged waits for an answer.
+                pass
+            finally:
+                if error is None:
+                    self.balancer.end(url, started)
+                elif conn.cancelled:
+                    self.balancer.abandon(url)
+                else:
+                    self.balancer.end(url, started, ok=(
+                        isinstance(error, SolrException) and
+                        error.httpcode < 500))
+            answers.put((url, error, value))
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def _cancel(self, url):
+        # The losing request may still be running on its connection.
+        conn = self.nodes[url]
+        self.nodes[url] = SolrConnection(url, **self.params)
+        conn.cancel()
+
+    def query(self, *args, **params):
+        return self._hedged('query', args, params)
+
+    def raw_query(self, **params):
+        return self._hedged('raw_query', (), params)
+
+    def raw_query_many(self, queries):
+        return self._call('raw_query_many', queries)
+
+    def query_cursor(self, *args, **params):
+        # A cursor is consumed lazily, so it stays on one node.
+        url = self.balancer.choose()
+        return self.nodes[url].query_cursor(*args, **params)
+
+    def add(self, *args, **fields):
+        return self._call('add', *args, **fields)
+
+    def add_many(self, docs, _commit=False):
+        # A streamed (iterator) batch cannot be sent again to another node.
+        return self._request('add_many', (docs, _commit), {},
+                             failover=isinstance(docs, (list, tuple)))
+
+    def delete(self, *args, **kw):
+        return self._call('delete', *args, **kw)
+
+    def delete_many(self, *args, **kw):
+        return self._call('delete_many', *args, **kw)
+
+    def delete_query(self, *args, **kw):
+        return self._call('delete_query', *args, **kw)
+
+    def commit(self, *args, **kw):
+        return self._call('commit', *args, **kw)
+
+    def optimize(self, *args, **kw):
+        return self._call('optimize', *args, **kw)
+
+    def close(self):
+        for conn in self.nodes.values():
+            conn.close()
+
+
+def _request_key(relpath, request):
+    # The order of the encoded parameters follows a dictionary.
+    return relpath + '?' + '&'.join(sorted(request.split('&')))
+
+
+class SolrRecorder(object):
+
+    """
+    Appends queries and their raw responses to a gzip compressed file,
+    one JSON list [request handler, request body, seconds, response] per
+    line.  Can be shared by several connections and threads.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = GzipFile(fname, 'ab')
+        self.lock = threading.Lock()
+
+    def record(self, relpath, request, response, seconds):
+        line = json.dumps([relpath, request, round(seconds, 6),
+                           response.decode('utf-8')], separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class SolrRecording(object):
+
+    """
+    The responses of a file written by SolrRecorder, by request.  Of
+    repeated requests, the last response is kept.  Without a file name,
+    the recording is empty and every request is unrecorded.
+    """
+
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.responses = {}
+        if fname is None:
+            return
+        f = GzipFile(fname, 'rb')
+        try:
+            for line in f:
+                relpath, request, seconds, response = json.loads(line)
+                self.responses[_request_key(relpath, request)] = (
+                    seconds, response.encode('utf-8'))
+        finally:
+            f.close()
+
+    def get(self, relpath, request):
+        """
+        Return (seconds, raw response) of a request, None if it was not
+        recorded.
+        """
+        return self.responses.get(_request_key(relpath, request))
+
+
+class _ReplayedResponse(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def getheader(self, name, default=None):
+        return default
+
+
+class ReplaySolrConnection(SolrConnection):
+
+    """
+    A SolrConnection answering queries from a SolrRecording instead of a
+    Solr server, see "Record and Replay" above.
+    """
+
+    def __init__(self, url, recording, latency=0.0, recorded_latency=False,
+                 **params):
+        """
+            url -- URI of the recorded Solr instance; only its path is
+                used.
+
+            recording -- SolrRecording, or the name of a file written by
+                SolrRecorder.
+
+            latency -- Seconds to wait before answering a request or a
+                pipelined batch of requests.
+
+            recorded_latency -- Also wait for the recorded duration of
+                each request.
+
+        Other parameters are those of SolrConnection.
+        """
+        SolrConnection.__init__(self, url, **params)
+        if isinstance(recording, basestring):
+            recording = SolrRecording(recording)
+        self.recording = recording
+        self.latency = latency
+        self.recorded_latency = recorded_latency
+
+    def _replay(self, url, body):
+        relpath = url[len(self.path):]
+        recorded = self.recording.get(relpath, body)
+        if recorded is None:
+            raise SolrException(404, "Not recorded: %s?%s" % (relpath, body))
+        return recorded
+
+    def _post(self, url, body, headers):
+        seconds, data = self._replay(url, body)
+        time.sleep(self.latency + (self.recorded_latency and seconds or 0))
+        return _ReplayedResponse(data)
+
+    def _post_many(self, url, bodies, headers):
+        recorded = [self._replay(url, body) for body in bodies]
+        delay = self.latency
+        if self.recorded_latency:
+            delay += sum([seconds for seconds, data in recorded])
+        time.sleep(delay)
+        return [data for seconds, data in recorded]
+
+
+class _Prefetch(threading.Thread):
+
+    """
+    Runs a single request in the background; result() waits for it and
+    returns its value or raises its exception.
+    """
+
+    def __init__(self, function, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.function = function
+        self.args = args
+        self.value = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.function(*self.args)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def result(self):
+        self.join()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
 
 
 class SearchHandler(object):
 
     def __init__(self, conn, relpath="/select", arg_separator="_"):
         self.conn = conn
+        self.relpath = relpath
         self.selector = conn.path + relpath
         self.arg_separator = arg_separator
 
@@ -797,6 +1622,13 @@ class SearchHandler(object):
 
         params['fl'] = fields
         params['version'] = self.conn.response_version
+
+        if self.conn.response_format == 'json':
+            params['wt'] = 'json'
+            params['json_nl'] = 'map'
+            data = self.raw(**params)
+            return parse_json_query_response(data, params, self)
+
         params['wt'] = 'standard'
 
         xml = self.raw(**params)
@@ -809,30 +1641,119 @@ class SearchHandler(object):
         Return the raw result.  No pre-processing or post-processing
         happens to either input parameters or responses.
         """
-        # Clean up optional parameters to match SOLR spec.
-        query = []
-        for key, value in params.items():
-            key = key.replace(self.arg_separator, '.')
-            if isinstance(value, (list, tuple)):
-                query.extend([(key, strify(v)) for v in value])
-            else:
-                query.append((key, strify(value)))
-        request = urllib.urlencode(query, doseq=True)
+        request = self._encode(params)
         conn = self.conn
         if conn.debug:
             logging.info("solrpy request: %s" % request)
 
         try:
+            start = time.time()
             rsp = conn._post(self.selector, request, conn.form_headers)
-            data = rsp.read()
+            data = read_response(rsp)
             if conn.debug:
                 logging.info("solrpy got response: %s" % data)
+            if conn.recorder is not None:
+                conn.recorder.record(self.relpath, request, data,
+                                     time.time() - start)
         finally:
             if not conn.persistent:
                 conn.close()
 
         return data
 
+    def raw_many(self, queries):
+        """
+        Issue several queries, each a dictionary of parameters as for
+        raw(), pipelined over the same connection.
+
+        Return the list of raw results, in the order of `queries`.
+        """
+        requests = [self._encode(params) for params in queries]
+        conn = self.conn
+        if conn.debug:
+            for request in requests:
+                logging.info("solrpy request: %s" % request)
+
+        try:
+            start = time.time()
+            data = conn._post_many(self.selector, requests, conn.form_headers)
+            if conn.debug:
+                for result in data:
+                    logging.info("solrpy got response: %s" % result)
+            if conn.recorder is not None:
+                elapsed = (time.time() - start) / max(1, len(requests))
+                for request, result in zip(requests, data):
+                    conn.recorder.record(self.relpath, request, result, elapsed)
+        finally:
+            if not conn.persistent:
+                conn.close()
+
+        return data
+
+    def _encode(self, params):
+        # Clean up optional parameters to match SOLR spec.
+        query = _encode_params(params, self.arg_separator)
+        template = params.get('template')
+        if template is not None:
+            query.append(template.encoded(self.arg_separator))
+        return '&'.join(query)
+
+
+class QueryTemplate(object):
+
+    """
+    Parameters shared by many raw queries, URL encoded once.  Passed as
+    the `template` parameter of raw_query() and raw_query_many(), they are
+    appended to the other parameters of a query; `qt` selects the request
+    handler like the parameter of raw_query().
+    """
+
+    def __init__(self, qt=None, **params):
+        self.qt = qt
+        self.params = params
+        self._encoded = {}
+
+    def encoded(self, arg_separator='_'):
+        encoded = self._encoded.get(arg_separator)
+        if encoded is None:
+            encoded = self._encoded[arg_separator] = '&'.join(
+                _encode_params(self.params, arg_separator))
+        return encoded
+
+
+class Encoded(str):
+
+    """
+    A parameter value that is URL encoded already, so that queries can
+    splice variable text into constant parts encoded once.
+    """
+
+
+def _encode_params(params, arg_separator):
+    # "key=value" pairs as urllib.urlencode(doseq=True) encodes them,
+    # without the template.
+    query = []
+    for key, value in params.items():
+        if key == 'template':
+            continue
+        key = quote_plus(key.replace(arg_separator, '.')) + '='
+        if isinstance(value, (list, tuple)):
+            query.extend([key + _quote(v) for v in value])
+        else:
+            query.append(key + _quote(value))
+    return query
+
+
+def _quote(value):
+    # What urllib.urlencode() makes of a single value, without its checks.
+    if isinstance(value, Encoded):
+        return value
+    if isinstance(value, unicode):
+        return quote_plus(value.encode('utf-8'))
+    if isinstance(value, str):
+        return quote_plus(value)
+    return quote_plus(str(value))
+
 
 def strify(s):
     if isinstance(s, unicode):
@@ -1104,9 +2025,142 @@ class Node(object):
                       for attr, val in self.attrs.items()]))
 
 
+# ===================================================================
+# JSON Parsing support
+# ===================================================================
+_json_decode = json.JSONDecoder().decode
+
+_date_match = re.compile(
+    r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d+)?Z$').match
+
+
+def _json_date(value):
+    if isinstance(value, unicode) and _date_match(value):
+        return utc_from_string(value)
+    return value
+
+
+def _json_doc(doc):
+    # JSON has no date type; convert the values the XML parser would
+    # have seen as <date> elements.
+    for name, value in doc.iteritems():
+        if isinstance(value, list):
+            doc[name] = [_json_date(v) for v in value]
+        else:
+            doc[name] = _json_date(value)
+    return doc
+
+
+def parse_json_query_response(data, params, query):
+    """
+    Parse the JSON (wt=json, json.nl=map) results of a /select call into
+    the same Response/Results objects as parse_query_response().
+    """
+    parsed = _json_decode(data)
+    response = Response(query)
+    for name, value in parsed.iteritems():
+        if name == 'responseHeader':
+            response.header = value
+        elif name == 'response':
+            results = Results([_json_doc(doc) for doc in value['docs']])
+            for attr_name, attr_value in value.iteritems():
+                if attr_name != 'docs':
+                    setattr(response, attr_name, attr_value)
+                    setattr(results, attr_name, unicode(attr_value))
+            response.results = results
+        else:
+            setattr(response, name, value)
+    response._params = params
+    response._query = query
+    return response
+
+
 # ===================================================================
 # Misc utils
 # ===================================================================
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def _json_value(value):
+    if isinstance(value, datetime.datetime):
+        return utc_to_string(value)
+    elif isinstance(value, datetime.date):
+        value = datetime.datetime.combine(value, datetime.time(tzinfo=UTC()))
+        return utc_to_string(value)
+    return value
+
+
+def _json_update_chunks(docs, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Generate a Solr JSON update body (an array of documents) as a
+    sequence of byte strings of roughly `chunk_size` bytes.
+
+    Field values are converted like the XML writer does: None values
+    are dropped, sets and tuples become lists and dates are formatted
+    as Solr UTC strings.
+    """
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    buf = []
+    size = 0
+    sep = '['
+    for fields in docs:
+        doc = {}
+        for field, value in fields.items():
+            if isinstance(value, (list, tuple, set)):
+                value = [_json_value(v) for v in value if v is not None]
+            elif value is None:
+                continue
+            else:
+                value = _json_value(value)
+            doc[field] = value
+        encoded = sep + dumps(doc)
+        sep = ','
+        buf.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if sep == '[':
+        buf.append(sep)
+    buf.append(']')
+    yield ''.join(buf)
+
+
+class _SharedFile(object):
+
+    """
+    Buffered socket file shared by the pipelined responses read from one
+    connection.  HTTPResponse closes its file once the body is read,
+    which must not discard the buffered start of the next response.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def makefile(self, *args):
+        return self
+
+    def readline(self, *args):
+        return self.fp.readline(*args)
+
+    def read(self, *args):
+        return self.fp.read(*args)
+
+    def close(self):
+        pass
+
+
+def read_response(response):
+    """
+    Read the body of an HTTP response, decompressing gzip encoded ones.
+    """
+    data = response.read()
+    if response.getheader('content-encoding', '').lower() == 'gzip':
+        data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    return data
+
+
 def check_response_status(response):
     if response.status != 200:
         ex = SolrException(response.status, response.reason)
@@ -0,0 +1,391 @@
+"""
+Tests of the connection handling of solr.py against in-process HTTP
+servers: pipelining, failover between replicas and hedged requests.
+
+    cd disambiguation && python -m unittest test_solr
+"""
+import json
+import socket
+import threading
+import time
+import unittest
+import zlib
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+import solr
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.answered = 0
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        params = dict((key, values[0])
+                      for key, values in urlparse.parse_qs(body).items())
+        self.answered += 1
+        with self.server.lock:
+            self.server.requests.append((self.path, params))
+        answer = self.server.respond(self.path, params, self.answered)
+        if answer is None:
+            # drop the connection without answering
+            self.close_connection = 1
+            return
+        status, data, headers = answer
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def echo(path, params, answered):
+    return 200, json.dumps({'path': path, 'q': params.get('q')}), []
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """
+    Answers each POST with respond(path, params, number of the request on
+    its connection): (status, body, headers), or None to drop the
+    connection.  Records the requests and counts the connections.
+    """
+
+    def __init__(self, respond=echo):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.respond = respond
+        self.requests = []
+        self.connections = 0
+        self.accepted = []
+        self.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:%d/solr' % self.server_port
+        thread = threading.Thread(target=self.serve_forever, args=(0.01,))
+        thread.daemon = True
+        thread.start()
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        with self.lock:
+            self.accepted.append((request, thread))
+        thread.start()
+
+    def handle_error(self, request, client_address):
+        # clients going away mid-request are part of the tests
+        pass
+
+    def stop(self):
+        """Stop serving and end the connections kept alive."""
+        self.shutdown()
+        self.server_close()
+        for request, thread in self.accepted:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join(5)
+
+    def queries(self):
+        return [params.get('q') for path, params in self.requests
+                if path.endswith('/select')]
+
+
+def _answered(results):
+    return [json.loads(result)['q'] for result in results]
+
+
+class PipelineTest(unittest.TestCase):
+
+    def start(self, respond=echo):
+        server = Server(respond)
+        self.addCleanup(server.stop)
+        return server
+
+    def connect(self, server, **params):
+        conn = solr.SolrConnection(server.url, **params)
+        self.addCleanup(conn.close)
+        return conn
+
+    def queries(self, n):
+        return [dict(q=str(i), wt='json') for i in range(n)]
+
+    def test_order(self):
+        server = self.start()
+        conn = self.connect(server, pipeline_depth=3)
+        results = conn.raw_query_many(self.queries(10))
+        self.assertEqual(_answered(results), [str(i) for i in range(10)])
+        self.assertEqual(server.connections, 1)
+
+    def test_server_closes_mid_window(self):
+        def respond(path, params, answered):
+            status, data, headers = echo(path, params, answered)
+            if answered == 4:
+                headers = [('Connection', 'close')]
+            return status, data, headers
+        server = self.start(respond)
+        conn = self.connect(server, pipeline_depth=3)
+        results = conn.raw_query_many(self.queries(10))
+        self.assertEqual(_answered(results), [str(i) for i in range(10)])
+        # the requests pipelined after the close are sent again, once
+        self.assertEqual(sorted(server.queries(), key=int),
+                         [str(i) for i in range(10)])
+        self.assertEqual(server.connections, 3)
+
+    def test_connection_dropped_mid_window(self):
+        dropped = []
+
+        def respond(path, params, answered):
+            if answered == 3 and not dropped:
+                dropped.append(params['q'])
+                return None
+            return echo(path, params, answered)
+        server = self.start(respond)
+        conn = self.connect(server, pipeline_depth=4)
+        results = conn.raw_query_many(self.queries(8))
+        self.assertEqual(_answered(results), [str(i) for i in range(8)])
+        self.assertEqual(dropped, ['2'])
+        self.assertEqual(server.connections, 2)
+
+    def test_server_error_mid_pipeline(self):
+        def respond(path, params, answered):
+            if params.get('q') == '3':
+                return 500, 'broken', []
+            return echo(path, params, answered)
+        server = self.start(respond)
+        conn = self.connect(server, pipeline_depth=4)
+        try:
+            conn.raw_query_many(self.queries(6))
+            self.fail('no SolrException')
+        except solr.SolrException, e:
+            self.assertEqual(e.httpcode, 500)
+        # the responses still queued were dropped with the connection
+        results = conn.raw_query_many([dict(q='next', wt='json')])
+        self.assertEqual(_answered(results), ['next'])
+
+
+class Replica(object):
+
+    """
+    Server behaviour switchable during a test: queries are answered with
+    `status` after `delay` seconds, as a corrupt gzip body if `corrupt`;
+    pings are answered with `ping`.  stop() ends the delays.
+    """
+
+    def __init__(self, status=200, ping=200, delay=0, corrupt=False):
+        self.status = status
+        self.ping = ping
+        self.delay = delay
+        self.corrupt = corrupt
+        self.stopped = threading.Event()
+
+    def __call__(self, path, params, answered):
+        if path.endswith('/admin/ping'):
+            return self.ping, json.dumps({'status': 'OK'}), []
+        if self.delay:
+            self.stopped.wait(self.delay)
+        if self.corrupt:
+            return self.status, 'not gzip', [('Content-Encoding', 'gzip')]
+        status, data, headers = echo(path, params, answered)
+        return self.status, data, headers
+
+
+class FailoverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = Replica(), Replica()
+        self.servers = [Server(self.a), Server(self.b)]
+        for server in self.servers:
+            self.addCleanup(server.stop)
+        # cleanups run last in first out: wake the replicas, then stop
+        for replica in (self.a, self.b):
+            self.addCleanup(replica.stopped.set)
+        self.urls = [server.url for server in self.servers]
+
+    def connect(self, **kw):
+        balancer = solr.SolrBalancer(self.urls, **kw)
+        # the first node is preferred while it has no latency
+        balancer.latency[self.urls[1]] = 1.0
+        conn = solr.BalancedSolrConnection(self.urls, balancer=balancer,
+                                           max_retries=0)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_failover_and_ejection(self):
+        self.a.status = 503
+        conn = self.connect(max_failures=2, eject_time=60)
+        for i in range(3):
+            self.assertEqual(json.loads(conn.raw_query(q=str(i)))['q'],
+                             str(i))
+        # ejected after its second failure, so the third query skipped it
+        self.assertEqual(self.servers[0].queries(), ['0', '1'])
+        self.assertEqual(self.servers[1].queries(), ['0', '1', '2'])
+        self.assertTrue(self.urls[0] in conn.balancer.ejected)
+        self.assertEqual(conn.balancer.outstanding,
+                         dict.fromkeys(self.urls, 0))
+
+    def test_rejected_query_not_failed_over(self):
+        self.a.status = 400
+        conn = self.connect()
+        try:
+            conn.raw_query(q='bad')
+            self.fail('no SolrException')
+        except solr.SolrException, e:
+            self.assertEqual(e.httpcode, 400)
+        self.assertEqual(self.servers[1].requests, [])
+        self.assertEqual(conn.balancer.failures[self.urls[0]], 0)
+
+    def test_all_down(self):
+        self.a.status = self.b.status = 503
+        conn = self.connect()
+        try:
+            conn.raw_query(q='x')
+            self.fail('no SolrException')
+        except solr.SolrException, e:
+            self.assertEqual(e.httpcode, 503)
+        self.assertEqual([server.queries() for server in self.servers],
+                         [['x'], ['x']])
+
+    def test_readmission(self):
+        self.a.status = self.a.ping = 503
+        conn = self.connect(max_failures=1, eject_time=0.05)
+        conn.raw_query(q='down')
+        self.assertTrue(self.urls[0] in conn.balancer.ejected)
+        self.a.status = self.a.ping = 200
+        time.sleep(0.1)
+        # the query after the ejection time probes the node first
+        conn.raw_query(q='up')
+        self.assertEqual([path for path, params in self.servers[0].requests],
+                         ['/solr/select', '/solr/admin/ping', '/solr/select'])
+        self.assertEqual(self.servers[0].queries(), ['down', 'up'])
+        self.assertEqual(conn.balancer.ejected, {})
+
+    def test_failed_probe_extends_ejection(self):
+        self.a.status = self.a.ping = 503
+        conn = self.connect(max_failures=1, eject_time=0.05)
+        conn.raw_query(q='down')
+        time.sleep(0.1)
+        conn.raw_query(q='still down')
+        self.assertEqual(self.servers[0].queries(), ['down'])
+        self.assertTrue(conn.balancer.ejected[self.urls[0]] > time.time())
+        self.assertEqual(self.servers[1].queries(), ['down', 'still down'])
+
+
+class HedgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = Replica(), Replica()
+        self.servers = [Server(self.a), Server(self.b)]
+        for server in self.servers:
+            self.addCleanup(server.stop)
+        # cleanups run last in first out: wake the replicas, then stop
+        for replica in (self.a, self.b):
+            self.addCleanup(replica.stopped.set)
+        self.urls = [server.url for server in self.servers]
+
+    def connect(self, delay):
+        """A connection hedging after `delay` seconds, first node first."""
+        self.events = []
+        balancer = solr.SolrBalancer(self.urls, observer=self.events.append)
+        balancer.latency[self.urls[1]] = 1.0
+        balancer.samples.extend([delay] * solr.SolrBalancer.HEDGE_MIN_SAMPLES)
+        conn = solr.BalancedSolrConnection(self.urls, balancer=balancer,
+                                           hedge_percentile=95, max_retries=0)
+        self.addCleanup(conn.close)
+        return conn
+
+    def query(self, conn, q):
+        """(error, answered q) of a raw_query, failing instead of hanging"""
+        result = []
+
+        def run():
+            try:
+                result.append((None, json.loads(conn.raw_query(q=q))['q']))
+            except Exception, e:
+                result.append((e, None))
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertTrue(result, 'no answer within 5 seconds')
+        return result[0]
+
+    def assertSettled(self, balancer):
+        for i in range(200):
+            if not any(balancer.outstanding.values()):
+                break
+            time.sleep(0.01)
+        self.assertEqual(balancer.outstanding, dict.fromkeys(self.urls, 0))
+
+    def test_not_hedged(self):
+        conn = self.connect(0.5)
+        self.assertEqual(self.query(conn, 'x'), (None, 'x'))
+        self.assertEqual(conn.balancer.hedged, 0)
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.servers[1].requests, [])
+
+    def test_slow_node_hedged_and_cancelled(self):
+        self.a.delay = 1.0
+        conn = self.connect(0.05)
+        slow = conn.nodes[self.urls[0]]
+        started = time.time()
+        self.assertEqual(self.query(conn, 'x'), (None, 'x'))
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual((conn.balancer.hedged, conn.balancer.hedges_won),
+                         (1, 1))
+        self.assertEqual(self.events, ['hedged', 'won'])
+        self.assertTrue(slow.cancelled)
+        self.assertSettled(conn.balancer)
+        # a cancelled request is no failure of its node
+        self.assertEqual(conn.balancer.failures[self.urls[0]], 0)
+        self.a.delay = 0
+        self.assertEqual(self.query(conn, 'y'), (None, 'y'))
+        self.assertEqual(self.servers[0].queries(), ['x', 'y'])
+
+    def test_failed_node_falls_back_to_hedge(self):
+        self.a.delay, self.a.status = 0.15, 503
+        self.b.delay = 0.3
+        conn = self.connect(0.05)
+        self.assertEqual(self.query(conn, 'x'), (None, 'x'))
+        self.assertEqual((conn.balancer.hedged, conn.balancer.hedges_won),
+                         (1, 1))
+        self.assertEqual(conn.balancer.failures[self.urls[0]], 1)
+        self.assertSettled(conn.balancer)
+
+    def test_unexpected_error(self):
+        self.a.corrupt = True
+        for delay in (None, 0.05):
+            conn = self.connect(delay or 0.05)
+            conn.hedge_percentile = delay and 95
+            error, answered = self.query(conn, 'x')
+            self.assertTrue(isinstance(error, zlib.error), error)
+            self.assertSettled(conn.balancer)
+
+    def test_unexpected_error_cancels_hedge(self):
+        self.a.delay, self.a.corrupt = 0.15, True
+        self.b.delay = 1.0
+        conn = self.connect(0.05)
+        started = time.time()
+        error, answered = self.query(conn, 'x')
+        self.assertTrue(isinstance(error, zlib.error), error)
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual(conn.balancer.hedged, 1)
+        self.assertEqual(self.events, ['hedged'])
+        self.assertSettled(conn.balancer)
+        self.assertEqual(conn.balancer.failures[self.urls[1]], 0)
+
+if __name__ == '__main__':
+    unittest.main()
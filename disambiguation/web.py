@@ -1,20 +1,83 @@
-from bottle import abort, route, run, template, request
+from bottle import abort, route, run, template, request, response, HTTPError
+import os
+import time
 import disambiguation
+import metrics
+import profiler
+
+# phase timings and cache outcomes for /metrics
+disambiguation.TIMING = True
+
+# The languages served, from the environment variable LANGUAGES (e.g.
+# LANGUAGES="en de"), by default all of disambiguation.LANGUAGES. Only
+# these are initialized at startup.
+LANGUAGES = os.environ.get("LANGUAGES", "").split() or list(disambiguation.LANGUAGES)
+
+
+def measured(callback):
+    '''count the requests of a route by status, time them and track the
+       requests in flight'''
+    def wrapper(*args, **kw):
+        metrics.adjustGauge("requests_in_flight", "", 1)
+        start = time.time()
+        status = 500
+        try:
+            result = callback(*args, **kw)
+            status = 200
+            return result
+        except HTTPError, e:
+            status = e.status_code
+            raise
+        finally:
+            metrics.adjustGauge("requests_in_flight", "", -1)
+            metrics.observe("request_seconds", callback.__name__, time.time() - start)
+            metrics.increment("requests", str(status))
+    return wrapper
 
 
 @route('/link')
+@measured
 def link():
     if request.params.get('ne') is not None:
         ne = request.params.get('ne')
-        link, p, mainLabel = disambiguation.linkEntity(ne)
+        lang = request.params.get('lang', disambiguation.LANG)
+        if lang not in LANGUAGES:
+            abort(400, "Unsupported language (\"lang=%s\")." % lang)
+        try:
+            link, p, mainLabel = disambiguation.linkEntity(ne, lang, request.params.get('type'))
+        except disambiguation.SolrUnavailable, e:
+            abort(503, "Label database unavailable: %s" % e)
         result = dict()
         result['ne'] = ne
         if link is not None:
             result['link'] = link[1:-1]
             result['p'] = p
             result['name'] = mainLabel
+        metrics.increment("links", link is not None and "linked" or "unlinked")
         return result
     else:
         abort(400, "No fitting argument (\"ne=...\") given.")
 
+
+@route('/profile')
+def profile():
+    if profiler.PROFILE_DIR is None:
+        abort(404, "Profiling is disabled, set PROFILE_DIR.")
+    try:
+        seconds = float(request.params.get('seconds', profiler.PROFILE_SECONDS))
+    except ValueError:
+        abort(400, "Invalid number of seconds.")
+    fname = profiler.profile(seconds)
+    if fname is None:
+        abort(409, "A profile is already running.")
+    return dict(file=fname, seconds=seconds)
+
+
+@route('/metrics')
+def metricsPage():
+    response.content_type = "text/plain; version=0.0.4"
+    return metrics.prometheus()
+
+disambiguation.initialize(LANGUAGES)
+profiler.install()
 run(host='localhost', port=5000)